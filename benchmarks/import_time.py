@@ -0,0 +1,110 @@
+"""Import time benchmark of the nestednereval modules.
+Each module is imported in fresh interpreters, so the measure is the cold start cost paid by
+short-lived evaluation workers. The core modules must only import the standard library: the
+run fails if one of them loads NumPy.
+
+Usage:
+    python benchmarks/import_time.py --output imports.json
+    python benchmarks/import_time.py --compare imports.json --threshold 1.5
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Modules that must not import NumPy.
+CORE_MODULES = ['nestednereval.utils', 'nestednereval.evaluator', 'nestednereval.metrics', 'nestednereval.breakdown',
+                'nestednereval.parallel', 'nestednereval.cache', 'nestednereval.matching', 'nestednereval.profiling',
+                'nestednereval.cli', 'nestednereval.documents', 'nestednereval.errors', 'nestednereval.service',
+                'nestednereval.spans', 'nestednereval.compare']
+
+NUMPY_MODULES = ['nestednereval.vectorized', 'nestednereval.resampling', 'nestednereval.spanstore', 'nestednereval.batch']
+
+_PROBE = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(seconds, 'numpy' in sys.modules)
+'''
+
+
+def measure(module, repeat):
+    """Median import time of a module over repeat fresh interpreters, and whether it loaded NumPy."""
+    times = []
+    loads_numpy = False
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT) + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _PROBE.format(module=module)], check=True, env=env,
+                                stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+        times.append(float(output[0]))
+        loads_numpy = output[1] == 'True'
+    return statistics.median(times), loads_numpy
+
+
+def run(args):
+    records = []
+    for module in args.modules or CORE_MODULES + NUMPY_MODULES:
+        seconds, loads_numpy = measure(module, args.repeat)
+        records.append({'module': module, 'seconds': seconds, 'loads_numpy': loads_numpy,
+                        'core': module in CORE_MODULES})
+        print('{module:<30} {seconds:8.4f}s numpy={loads_numpy}'.format(**records[-1]), file=sys.stderr)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'records': records,
+    }
+
+
+def compare(current, previous, threshold):
+    """Records of current that are slower to import than in previous by more than threshold times."""
+    baseline = {record['module']: record for record in previous['records']}
+    regressions = []
+    for record in current['records']:
+        old = baseline.get(record['module'])
+        if old and old['seconds'] and record['seconds'] > threshold*old['seconds']:
+            regressions.append({'module': record['module'], 'seconds': record['seconds'],
+                                'previous_seconds': old['seconds'], 'ratio': record['seconds']/old['seconds']})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--modules', nargs='+', help='modules to import (all the package modules by default)')
+    parser.add_argument('--repeat', type=int, default=7, help='fresh interpreters per module (the median is kept)')
+    parser.add_argument('--output', help='JSON file with the results (stdout by default)')
+    parser.add_argument('--compare', help='previous JSON results, exits with 1 if an import regressed')
+    parser.add_argument('--threshold', type=float, default=1.5, help='slowdown ratio considered a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    status = 0
+    for record in results['records']:
+        if record['core'] and record['loads_numpy']:
+            print('{} imports NumPy'.format(record['module']), file=sys.stderr)
+            status = 1
+    if args.compare:
+        with open(args.compare, encoding='UTF-8') as previous:
+            regressions = compare(results, json.load(previous), args.threshold)
+        for regression in regressions:
+            print('Regression: {module} {previous_seconds:.4f}s -> {seconds:.4f}s ({ratio:.2f}x)'.format(**regression),
+                  file=sys.stderr)
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+"""Benchmarks of the evaluation pipeline on synthetic nested NER corpora.
+Times get_nestings, every metric of nestednereval.metrics, read_iob2_prediction_file and
+get_entities over a sweep of corpus sizes, and writes the throughput and peak memory of each
+run as JSON so results of different releases can be compared.
+
+With --check, the alternative engines are instead compared with the reference implementations
+on random corpora with crossing, same-span and duplicated entities: the sweep and naive
+get_nestings, evaluate_columns, strict relaxed matching, compact spans and LabelDecoder. Relaxed
+matching in every mode must also give the same standard and flat counts when nothing is nested,
+and span_credit must match a definition of each mode over sets of positions.
+
+Usage:
+    python benchmarks/run_benchmarks.py --sentences 1000 10000 --output bench.json
+    python benchmarks/run_benchmarks.py --compare bench.json --threshold 1.25
+    python benchmarks/run_benchmarks.py --check --corpora 1000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from nestednereval import metrics  # noqa: E402
+from nestednereval.utils import get_entities, get_nestings, read_iob2_prediction_file  # noqa: E402
+from synthetic import generate_corpus, random_entities, write_iob2  # noqa: E402
+
+CHECKS = ('nestings', 'vectorized', 'relaxed', 'relaxed_flat', 'credits', 'compact', 'labels')
+
+COMPACT_METRIC_FUNCTIONS = ['length_metric', 'nesting_level_metric_relaxed', 'nesting_level_metric_strict',
+                            'nesting_depth_histogram']
+
+METRIC_FUNCTIONS = ['standard_metric', 'flat_metric', 'inner_metric', 'outer_metric', 'nested_metric',
+                    'nesting_metric', 'length_metric', 'nesting_level_metric_relaxed',
+                    'nesting_level_metric_strict', 'nested_ner_metrics']
+
+
+def _measure(function, repeat):
+    """Best wall time over repeat runs, and peak traced memory of one extra run."""
+    seconds = float('inf')
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            seconds = min(seconds, time.perf_counter() - start)
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return seconds, peak
+
+
+def benchmark_cases(corpus, directory):
+    """(name, function, n_sentences, n_entities) of every benchmark over one corpus."""
+    n_sentences = len(corpus)
+    n_entities = sum(len(sent["real"]) + len(sent["pred"]) for sent in corpus)
+    sides = [sent[side] for sent in corpus for side in ("real", "pred")]
+    cases = [('get_nestings', lambda: [get_nestings(entities) for entities in sides], n_sentences, n_entities)]
+    for name in METRIC_FUNCTIONS:
+        function = getattr(metrics, name)
+        cases.append((name, lambda function=function: function(corpus), n_sentences, n_entities))
+
+    filepath = os.path.join(directory, 'TYPE0.iob2')
+    tag_sentences = write_iob2(filepath, corpus, 'TYPE0')
+    n_tagged = sum(len(get_entities(real_tags)) + len(get_entities(pred_tags)) for real_tags, pred_tags in tag_sentences)
+    cases.append(('read_iob2_prediction_file', lambda: read_iob2_prediction_file(filepath), n_sentences, n_tagged))
+    cases.append(('get_entities', lambda: [(get_entities(real_tags), get_entities(pred_tags))
+                                           for real_tags, pred_tags in tag_sentences], n_sentences, n_tagged))
+    return cases
+
+
+def run(args):
+    records = []
+    for n_sentences in args.sentences:
+        for entities_per_sentence in args.entities:
+            for max_depth in args.depth:
+                corpus = generate_corpus(n_sentences, entities_per_sentence, max_depth, args.types,
+                                         args.error_rate, args.seed)
+                with tempfile.TemporaryDirectory() as directory:
+                    for name, function, sentences, entities in benchmark_cases(corpus, directory):
+                        if args.only and name not in args.only:
+                            continue
+                        seconds, peak = _measure(function, args.repeat)
+                        records.append({
+                            'benchmark': name,
+                            'n_sentences': n_sentences,
+                            'entities_per_sentence': entities_per_sentence,
+                            'max_depth': max_depth,
+                            'n_types': args.types,
+                            'error_rate': args.error_rate,
+                            'seconds': seconds,
+                            'sentences_per_second': sentences/seconds if seconds else None,
+                            'entities_per_second': entities/seconds if seconds else None,
+                            'peak_memory_bytes': peak,
+                        })
+                        print('{benchmark:<30} sentences={n_sentences:<8} entities={entities_per_sentence:<4} '
+                              'depth={max_depth:<3} {seconds:10.4f}s {sentences_per_second:14.1f} sent/s '
+                              '{peak_memory_bytes:>12} B'.format(**records[-1]), file=sys.stderr)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'records': records,
+    }
+
+
+def _key(record):
+    return (record['benchmark'], record['n_sentences'], record['entities_per_sentence'], record['max_depth'],
+            record['n_types'], record['error_rate'])
+
+
+def compare(current, previous, threshold):
+    """Records of current that are slower than in previous by more than threshold times."""
+    baseline = {_key(record): record for record in previous['records']}
+    regressions = []
+    for record in current['records']:
+        old = baseline.get(_key(record))
+        if old and old['seconds'] and record['seconds'] > threshold*old['seconds']:
+            regressions.append({'benchmark': _key(record), 'seconds': record['seconds'],
+                                'previous_seconds': old['seconds'], 'ratio': record['seconds']/old['seconds']})
+    return regressions
+
+
+def _random_corpus(rng, n_sentences, types):
+    return [{"real": random_entities(rng, 8, 14, types), "pred": random_entities(rng, 8, 14, types)}
+            for _ in range(n_sentences)]
+
+
+def _without_nestings(entities):
+    # The distinct entities of a sentence that are not part of any nesting.
+    nested = {entity for nesting in get_nestings(entities) for entity in nesting}
+    return [entity for entity in dict.fromkeys(entities) if entity not in nested]
+
+
+def _reference_credit(real_entity, pred_entity, mode):
+    # Credit of a mode from the positions covered by the (end inclusive) spans.
+    if mode in ('strict', 'type', 'overlap') and real_entity[0] != pred_entity[0]:
+        return 0
+    if real_entity[1:] == pred_entity[1:]:
+        return 1
+    real_positions = set(range(real_entity[1], real_entity[2] + 1))
+    pred_positions = set(range(pred_entity[1], pred_entity[2] + 1))
+    common = len(real_positions & pred_positions)
+    if mode in ('strict', 'exact') or not common:
+        return 0
+    if mode == 'partial':
+        return 0.5
+    if mode == 'type':
+        return 1
+    return common / len(real_positions | pred_positions)
+
+
+def _random_labels(rng, label_map, batch, seq_len, n_columns):
+    import numpy as np
+
+    labels = np.array([rng.randrange(len(label_map)) for _ in range(batch*seq_len*n_columns)]).reshape(batch, seq_len, n_columns)
+    lengths = np.array([rng.randint(0, seq_len) for _ in range(batch)])
+    labels[np.arange(seq_len)[None, :] >= lengths[:, None]] = -100
+    return labels, lengths
+
+
+def check_equivalence(n_corpora=1000, seed=0):
+    """Compare every alternative engine with its reference implementation on random corpora.
+    Returns:
+        dict: check name -> number of corpora (or batches) where the results differ.
+    """
+    from nestednereval.batch import decode_label_arrays
+    from nestednereval.evaluator import evaluate_all
+    from nestednereval.matching import MODES, RelaxedEvaluator, span_credit
+    from nestednereval.spans import compact_corpus
+    from nestednereval.vectorized import vectorized_evaluate
+
+    rng = random.Random(seed)
+    types = ['A', 'B', 'C']
+    label_map = ['O', 'B-A', 'I-A', 'B-B', 'I-B']
+    mismatches = dict.fromkeys(CHECKS, 0)
+    for _ in range(n_corpora):
+        corpus = _random_corpus(rng, 5, types)
+        reference = evaluate_all(corpus)
+        if any(get_nestings(sent[side]) != get_nestings(sent[side], naive=True)
+               for sent in corpus for side in ("real", "pred")):
+            mismatches['nestings'] += 1
+        vectorized = vectorized_evaluate(corpus)
+        if vectorized.counts != reference.counts:
+            mismatches['vectorized'] += 1
+        if RelaxedEvaluator('strict').evaluate(corpus).counts != reference.counts:
+            mismatches['relaxed'] += 1
+        flat_corpus = [{side: _without_nestings(sent[side]) for side in ("real", "pred")} for sent in corpus]
+        for mode in MODES:
+            counts = RelaxedEvaluator(mode, ['standard', 'flat']).evaluate(flat_corpus).counts
+            if any(abs(a - b) > 1e-9 for a, b in zip(counts['standard'], counts['flat'])):
+                mismatches['relaxed_flat'] += 1
+                break
+        if any(abs(span_credit(real_entity, pred_entity, mode) - _reference_credit(real_entity, pred_entity, mode)) > 1e-9
+               for sent in corpus for real_entity in sent["real"] for pred_entity in sent["pred"] for mode in MODES):
+            mismatches['credits'] += 1
+        compact = compact_corpus(corpus)
+        if evaluate_all(compact).counts != reference.counts or any(
+                getattr(metrics, name)(compact) != getattr(metrics, name)(corpus) for name in COMPACT_METRIC_FUNCTIONS):
+            mismatches['compact'] += 1
+
+        labels, lengths = _random_labels(rng, label_map, 4, 12, 2)
+        decoded = decode_label_arrays(labels, label_map, lengths=lengths)
+        for row, length in enumerate(lengths.tolist()):
+            expected = [entity for column in range(labels.shape[2])
+                        for entity in get_entities([label_map[label] for label in labels[row, :length, column].tolist()])]
+            if decoded[row] != expected:
+                mismatches['labels'] += 1
+                break
+    return mismatches
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sentences', type=int, nargs='+', default=[1000, 10000], help='corpus sizes of the sweep')
+    parser.add_argument('--entities', type=int, nargs='+', default=[5, 20], help='gold entities per sentence')
+    parser.add_argument('--depth', type=int, nargs='+', default=[3], help='maximum nesting depths')
+    parser.add_argument('--types', type=int, default=4, help='number of entity types')
+    parser.add_argument('--error-rate', type=float, default=0.2, help='prediction error rate')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per benchmark (the best is kept)')
+    parser.add_argument('--only', nargs='+', help='benchmarks to run')
+    parser.add_argument('--output', help='JSON file with the results (stdout by default)')
+    parser.add_argument('--compare', help='previous JSON results, exits with 1 if a benchmark regressed')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown ratio considered a regression')
+    parser.add_argument('--check', action='store_true',
+                        help='check the alternative engines against the reference ones, exits with 1 on a mismatch')
+    parser.add_argument('--corpora', type=int, default=1000, help='random corpora compared by --check')
+    args = parser.parse_args(argv)
+
+    if args.check:
+        mismatches = check_equivalence(args.corpora, args.seed)
+        for name, count in mismatches.items():
+            print('{:<12} {}'.format(name, 'ok' if not count else '{} mismatches'.format(count)), file=sys.stderr)
+        return 1 if any(mismatches.values()) else 0
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, encoding='UTF-8') as previous:
+            regressions = compare(results, json.load(previous), args.threshold)
+        for regression in regressions:
+            print('Regression: {benchmark} {previous_seconds:.4f}s -> {seconds:.4f}s ({ratio:.2f}x)'.format(**regression),
+                  file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""Generator of synthetic nested NER corpora for the benchmarks.
+Sentences are made of disjoint chains of nested entities, and predictions are obtained by
+corrupting the gold entities (dropping them, changing their type or shifting a boundary) and
+adding spurious ones.
+"""
+import random
+
+
+def _nested_chain(rng, start, end, depth, types):
+    chain = [(rng.choice(types), start, end)]
+    while len(chain) < depth and end > start:
+        new_start = rng.randint(start, end)
+        new_end = rng.randint(new_start, end)
+        if (new_start, new_end) == (start, end):
+            new_end -= 1
+            if new_end < new_start:
+                break
+        start, end = new_start, new_end
+        chain.append((rng.choice(types), start, end))
+    return chain
+
+
+def generate_sentence(rng, n_entities, max_depth, types):
+    """Gold entities of one synthetic sentence.
+    Args:
+        rng (random.Random): random generator.
+        n_entities (int): number of entities of the sentence.
+        max_depth (int): maximum number of entities of a nesting chain.
+        types (list): entity types.
+    Returns:
+        list: list of (chunk_type, chunk_start, chunk_end), unique.
+    """
+    entities = []
+    position = 0
+    while len(entities) < n_entities:
+        depth = rng.randint(1, max_depth)
+        length = rng.randint(depth, 2*depth + 2)
+        for entity in _nested_chain(rng, position, position + length - 1, depth, types):
+            if entity not in entities:
+                entities.append(entity)
+        position += length + rng.randint(0, 3)
+    return entities[:n_entities]
+
+
+def corrupt(rng, entities, error_rate, types):
+    """Predicted entities obtained by corrupting the gold entities.
+    Args:
+        rng (random.Random): random generator.
+        entities (list): gold entities of one sentence.
+        error_rate (float): probability of corrupting each gold entity. Spurious entities are added
+            with half of this probability per gold entity.
+        types (list): entity types.
+    Returns:
+        list: list of predicted (chunk_type, chunk_start, chunk_end).
+    """
+    pred = []
+    for type_, start, end in entities:
+        if rng.random() < error_rate:
+            error = rng.randint(0, 2)
+            if error == 0:
+                continue
+            if error == 1:
+                type_ = rng.choice(types)
+            elif end > start:
+                end -= 1
+            else:
+                end += 1
+        pred.append((type_, start, end))
+        if rng.random() < error_rate/2:
+            start = rng.randint(max(0, start - 2), end)
+            pred.append((rng.choice(types), start, start + rng.randint(0, 2)))
+    return list(dict.fromkeys(pred))
+
+
+def generate_corpus(n_sentences=1000, entities_per_sentence=5, max_depth=3, n_types=4, error_rate=0.2, seed=0):
+    """Synthetic corpus in the format expected by nestednereval.metrics.
+    Args:
+        n_sentences (int): number of sentences.
+        entities_per_sentence (int): number of gold entities per sentence.
+        max_depth (int): maximum nesting depth.
+        n_types (int): number of entity types.
+        error_rate (float): prediction error rate (see corrupt).
+        seed (int): random seed.
+    Returns:
+        list: list of dicts, which contains predicted and original entities.
+    """
+    rng = random.Random(seed)
+    types = ['TYPE{}'.format(i) for i in range(n_types)]
+    corpus = []
+    for _ in range(n_sentences):
+        real = generate_sentence(rng, entities_per_sentence, max_depth, types)
+        corpus.append({"real": real, "pred": corrupt(rng, real, error_rate, types)})
+    return corpus
+
+
+def random_entities(rng, max_entities, length, types, max_duplicates=2):
+    """Arbitrary entities of one sentence, to check the evaluation engines against each other.
+    Unlike generate_sentence the spans may cross, share their boundaries with other types and
+    repeat the same entity.
+    Args:
+        rng (random.Random): random generator.
+        max_entities (int): maximum number of distinct entities.
+        length (int): number of tokens of the sentence.
+        types (list): entity types.
+        max_duplicates (int): maximum number of repeated entities.
+    Returns:
+        list: list of (chunk_type, chunk_start, chunk_end) in random order.
+    """
+    entities = []
+    for _ in range(rng.randint(0, max_entities)):
+        start = rng.randint(0, length - 1)
+        entities.append((rng.choice(types), start, rng.randint(start, min(length - 1, start + 4))))
+    for _ in range(rng.randint(0, max_duplicates)):
+        if entities:
+            entities.append(rng.choice(entities))
+    rng.shuffle(entities)
+    return entities
+
+
+def to_tags(entities, length, type_):
+    """IOB2 tags of the entities of a single type (the first one wins when they overlap)."""
+    tags = ['O'] * length
+    for entity_type, start, end in sorted(entities, key=lambda entity: (entity[1], -entity[2])):
+        if entity_type != type_ or any(tag != 'O' for tag in tags[start:end + 1]):
+            continue
+        tags[start] = 'B-' + type_
+        for i in range(start + 1, end + 1):
+            tags[i] = 'I-' + type_
+    return tags
+
+
+def write_iob2(filepath, corpus, type_):
+    """Write the entities of one type of a synthetic corpus as an IOB2 prediction file.
+    Returns:
+        list: the (real_tags, pred_tags) written per sentence.
+    """
+    sentences = []
+    with open(filepath, 'w', encoding='UTF-8') as iob2_file:
+        for sent in corpus:
+            length = max([entity[2] for entity in sent["real"] + sent["pred"]], default=0) + 2
+            real_tags = to_tags(sent["real"], length, type_)
+            pred_tags = to_tags(sent["pred"], length, type_)
+            for i, (real_tag, pred_tag) in enumerate(zip(real_tags, pred_tags)):
+                iob2_file.write('tok{} {} {}\n'.format(i, real_tag, pred_tag))
+            iob2_file.write('\n')
+            sentences.append((real_tags, pred_tags))
+    return sentences
@@ -0,0 +1,159 @@
+"""Evaluation of padded label-id arrays, as emitted by a model, without tag strings.
+Every label id of the label map is interned once in a TagDecoder, and its transition table is
+used as a NumPy array: for every token of every sequence and type column the table gives
+whether a chunk ends and/or starts there, and the begin offset of every chunk is the running
+maximum of the start positions. The decoded entities are the same as get_entities on the tag
+strings of every column, merged in column order as merge_predictions does.
+"""
+import numpy as np
+
+from nestednereval.utils import get_decoder
+
+
+def _label_maps(label_map, n_columns):
+    """One label map per column, from a shared label map or a list of label maps."""
+    if len(label_map) and not isinstance(label_map[0], str):
+        if len(label_map) != n_columns:
+            raise ValueError('Got {} label maps for {} type columns'.format(len(label_map), n_columns))
+        return [list(column_map) for column_map in label_map]
+    return [list(label_map)] * n_columns
+
+
+def _lengths(shape, lengths, mask):
+    batch, seq_len = shape
+    if mask is not None:
+        mask = np.asarray(mask, dtype=bool)
+        if mask.shape != (batch, seq_len):
+            raise ValueError('mask has shape {} but labels have {}'.format(mask.shape, (batch, seq_len)))
+        lengths = mask.sum(axis=1)
+        if not np.array_equal(mask, np.arange(seq_len)[None, :] < lengths[:, None]):
+            raise ValueError('mask must cover a prefix of every sequence (padding at the end)')
+        return lengths
+    if lengths is None:
+        return np.full(batch, seq_len, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if lengths.shape != (batch,) or (lengths < 0).any() or (lengths > seq_len).any():
+        raise ValueError('lengths must be {} integers between 0 and {}'.format(batch, seq_len))
+    return lengths
+
+
+def _as_columns(labels):
+    labels = np.asarray(labels)
+    if labels.ndim == 2:
+        labels = labels[:, :, None]
+    if labels.ndim != 3 or not np.issubdtype(labels.dtype, np.integer):
+        raise ValueError('labels must be an integer array of shape (batch, seq_len, n_types) or (batch, seq_len)')
+    return labels
+
+
+class LabelDecoder:
+    """Bulk decoder of label-id arrays into entities.
+    Args:
+        label_map (list): tag string of every label id (e.g. ['O', 'B-ANAT', 'I-ANAT']) shared by all the
+            type columns, or one such list per type column.
+        suffix (bool): tags have the prefix at the end (PER-B instead of B-PER).
+    """
+
+    def __init__(self, label_map, suffix=False):
+        self.label_map = label_map
+        self.decoder = get_decoder(suffix)
+        self._tag_ids = {}
+
+    def _column_tags(self, column_map):
+        key = tuple(column_map)
+        tag_ids = self._tag_ids.get(key)
+        if tag_ids is None:
+            tag_ids = self._tag_ids[key] = np.array([self.decoder.intern(label) for label in column_map], dtype=np.int64)
+        return tag_ids
+
+    def decode_columns(self, labels, lengths=None, mask=None):
+        """Entities of every sequence and type column as parallel arrays.
+        Args:
+            labels (array): integer array of shape (batch, seq_len, n_types), or (batch, seq_len) for one column.
+            lengths (array): length of every sequence, the full seq_len by default.
+            mask (array): boolean (batch, seq_len) array of the real tokens, instead of lengths.
+        Returns:
+            tuple: (rows, columns, types, starts, ends) arrays sorted by row, column and end, where types
+            holds the type string of every entity.
+        """
+        labels = _as_columns(labels)
+        batch, seq_len, n_columns = labels.shape
+        lengths = _lengths((batch, seq_len), lengths, mask)
+        tag_ids = [self._column_tags(column_map) for column_map in _label_maps(self.label_map, n_columns)]
+        transitions = np.array(self.decoder.transition_table(), dtype=np.int8)
+        outside = self.decoder.outside
+        padding = np.arange(seq_len)[None, :] >= lengths[:, None]
+        positions = np.arange(seq_len + 1)
+
+        parts = []
+        for column in range(n_columns):
+            # Padding positions may hold any value (e.g. -100), they are read as outside tags.
+            column_labels = np.where(padding, 0, labels[:, :, column])
+            if column_labels.size and (column_labels.min() < 0 or column_labels.max() >= len(tag_ids[column])):
+                raise ValueError('Label ids of type column {} must be between 0 and {}'.format(column, len(tag_ids[column]) - 1))
+            tags = tag_ids[column][column_labels]
+            tags[padding] = outside
+            prev = np.concatenate([np.zeros((batch, 1), dtype=np.int64), tags], axis=1)
+            cur = np.concatenate([tags, np.full((batch, 1), outside, dtype=np.int64)], axis=1)
+            codes = transitions[prev, cur]
+            # Begin offset at every position: last position <= it where a chunk started (0 before any).
+            last_start = np.maximum.accumulate(np.where(codes & 2, positions, 0), axis=1)
+            rows, ends = np.nonzero(codes & 1)
+            parts.append((rows, np.full(len(rows), column), prev[rows, ends], last_start[rows, ends - 1], ends - 1))
+
+        rows, columns, prev_tags, starts, ends = (np.concatenate(arrays) for arrays in zip(*parts))
+        order = np.lexsort((ends, columns, rows))
+        types = np.array(self.decoder.types, dtype=object)[prev_tags[order]]
+        return rows[order], columns[order], types, starts[order], ends[order]
+
+    def decode(self, labels, lengths=None, mask=None):
+        """Entities of every sequence, merged over the type columns.
+        Returns:
+            list: list of (chunk_type, chunk_start, chunk_end) lists, one per sequence.
+        """
+        batch = _as_columns(labels).shape[0]
+        rows, _, types, starts, ends = self.decode_columns(labels, lengths, mask)
+        entities = list(zip(types.tolist(), starts.tolist(), ends.tolist()))
+        bounds = np.searchsorted(rows, np.arange(batch + 1)).tolist()
+        return [entities[bounds[i]:bounds[i + 1]] for i in range(batch)]
+
+
+def decode_label_arrays(labels, label_map, lengths=None, mask=None, suffix=False):
+    """Decode padded label-id arrays into the entities of every sequence.
+    Args:
+        labels (array): integer array of shape (batch, seq_len, n_types), or (batch, seq_len).
+        label_map (list): see LabelDecoder.
+        lengths (array): length of every sequence, the full seq_len by default.
+        mask (array): boolean (batch, seq_len) array of the real tokens, instead of lengths.
+        suffix (bool): tags have the prefix at the end (PER-B instead of B-PER).
+    Returns:
+        list: list of (chunk_type, chunk_start, chunk_end) lists, one per sequence.
+    Example:
+        >>> decode_label_arrays(np.array([[1, 2, 0, 1]]), ['O', 'B-PER', 'I-PER'])
+        [[('PER', 0, 1), ('PER', 3, 3)]]
+    """
+    return LabelDecoder(label_map, suffix).decode(labels, lengths, mask)
+
+
+def batch_entities(real_labels, pred_labels, label_map, lengths=None, mask=None, suffix=False, dedupe_real=False):
+    """Real and predicted entities of a batch of padded label-id arrays.
+    Args:
+        real_labels (array): gold label ids, integer array of shape (batch, seq_len, n_types) or (batch, seq_len).
+        pred_labels (array): predicted label ids, same shape as real_labels.
+        label_map, lengths, mask, suffix: see decode_label_arrays.
+        dedupe_real (bool): keep only the first occurrence of real entities present in several type columns.
+    Returns:
+        list: list of dicts, which contains predicted and original entities.
+    Example:
+        >>> accumulator = MetricAccumulator()
+        >>> for real_labels, pred_labels, mask in dev_batches:
+        ...     accumulator.update_batch(batch_entities(real_labels, pred_labels, label_map, mask=mask))
+    """
+    if np.shape(real_labels) != np.shape(pred_labels):
+        raise ValueError('real_labels has shape {} but pred_labels has {}'.format(np.shape(real_labels), np.shape(pred_labels)))
+    decoder = LabelDecoder(label_map, suffix)
+    real = decoder.decode(real_labels, lengths, mask)
+    pred = decoder.decode(pred_labels, lengths, mask)
+    if dedupe_real:
+        real = [list(dict.fromkeys(entities)) for entities in real]
+    return [{"real": real_entities, "pred": pred_entities} for real_entities, pred_entities in zip(real, pred)]
@@ -0,0 +1,144 @@
+"""Per type, per category and per length breakdown of the nested NER metrics.
+Each sentence is analysed and matched once, and every entity (or nesting) adds its count to all
+the groups it belongs to at the same time: its (type, category, length bucket) group and the
+marginal groups where the type and/or the length are aggregated.
+"""
+from collections import defaultdict
+
+from nestednereval.evaluator import Evaluator, calculate_f1_score
+
+ALL = '*'
+
+LENGTH_BUCKETS = (1, 2, 3, 4, 5)
+
+COLUMNS = ('type', 'category', 'length', 'precision', 'recall', 'f1', 'support', 'tp', 'fp', 'fn')
+
+
+def length_bucket(length, length_buckets=LENGTH_BUCKETS):
+    """Label of the length bucket of an entity.
+    Args:
+        length (int): number of tokens of the entity.
+        length_buckets (tuple): sorted upper bounds of the buckets, None to use the exact length.
+    Returns:
+        str: e.g. '3', '4-5' or '6+' for the buckets (1, 2, 3, 5).
+    """
+    if length_buckets is None:
+        return str(length)
+    lower = 1
+    for upper in length_buckets:
+        if length <= upper:
+            return str(upper) if lower == upper else '{}-{}'.format(lower, upper)
+        lower = upper + 1
+    return '{}+'.format(lower)
+
+
+class Breakdown:
+    """Grouped counters of the metrics by entity type, category and length bucket.
+    The category is the metric family (standard, flat, inner, outer, nested or nesting). Nestings
+    are grouped by the type and length of their outermost entity.
+    Args:
+        metrics (iterable): categories to compute, by default all of METRICS.
+        length_buckets (tuple): sorted upper bounds of the length buckets, None for exact lengths.
+    """
+
+    def __init__(self, metrics=None, length_buckets=LENGTH_BUCKETS):
+        self.evaluator = Evaluator(metrics)
+        self.metrics = self.evaluator.metrics
+        self.length_buckets = length_buckets
+        self.counts = defaultdict(lambda: [0, 0, 0, 0])
+
+    def _add(self, entity, category, index):
+        type_ = entity[0]
+        length = length_bucket(entity[2]-entity[1]+1, self.length_buckets)
+        for key in ((type_, category, length), (type_, category, ALL), (ALL, category, length), (ALL, category, ALL)):
+            self.counts[key][index]+=1
+
+    def _add_real(self, entity, category, found):
+        type_ = entity[0]
+        length = length_bucket(entity[2]-entity[1]+1, self.length_buckets)
+        for key in ((type_, category, length), (type_, category, ALL), (ALL, category, length), (ALL, category, ALL)):
+            counts = self.counts[key]
+            counts[3]+=1
+            if found:
+                counts[0]+=1
+            else:
+                counts[2]+=1
+
+    def update(self, real, pred):
+        """Add the counts of one sentence given its real and predicted entities."""
+        real = self.evaluator.analyse(real)
+        pred = self.evaluator.analyse(pred)
+        for category in self.metrics:
+            if category == 'standard':
+                for entity in pred.entities:
+                    self._add(entity, category, 0 if entity in real.entity_set else 1)
+                for entity in real.entities:
+                    self._add(entity, category, 3)
+                    if entity not in pred.entity_set:
+                        self._add(entity, category, 2)
+                continue
+            if category == 'nesting':
+                real_items = [(nesting[0], key) for nesting, key in zip(real.nestings, real.nesting_keys)]
+                pred_items = [(nesting[0], key) for nesting, key in zip(pred.nestings, pred.nesting_keys)]
+                real_set, pred_set = real.nesting_set, pred.nesting_set
+            else:
+                real_entities = real.outer+real.inner if category == 'nested' else getattr(real, category)
+                pred_entities = pred.outer+pred.inner if category == 'nested' else getattr(pred, category)
+                real_items = [(entity, entity) for entity in real_entities]
+                pred_items = [(entity, entity) for entity in pred_entities]
+                real_set, pred_set = real.entity_set, pred.entity_set
+            for entity, key in real_items:
+                self._add_real(entity, category, key in pred_set)
+            for entity, key in pred_items:
+                if key not in real_set:
+                    self._add(entity, category, 1)
+
+    def update_batch(self, entities):
+        """Add the counts of a batch of sentences.
+        Args:
+            entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        """
+        for sent in entities:
+            self.update(sent["real"], sent["pred"])
+        return self
+
+    def rows(self):
+        """Tidy table with one row per (type, category, length) group.
+        Returns:
+            list: list of dicts with the keys of COLUMNS, sorted by category, type and length.
+        """
+        order = {metric: i for i, metric in enumerate(self.metrics)}
+
+        def sort_key(key):
+            type_, category, length = key
+            bucket = (1, 0) if length == ALL else (0, int(length.split('-')[0].rstrip('+')))
+            return order[category], type_ != ALL, type_, bucket
+
+        table = []
+        for key in sorted(self.counts, key=sort_key):
+            tp, fp, fn, support = self.counts[key]
+            precision, recall, f1 = calculate_f1_score(tp, fp, fn)
+            table.append(dict(zip(COLUMNS, key + (precision, recall, f1, support, tp, fp, fn))))
+        return table
+
+    def to_tsv(self):
+        """Table as tab separated values with a header line."""
+        lines = ['\t'.join(COLUMNS)]
+        for row in self.rows():
+            lines.append('\t'.join(str(row[column]) for column in COLUMNS))
+        return '\n'.join(lines) + '\n'
+
+
+def breakdown(entities, metrics=None, length_buckets=LENGTH_BUCKETS):
+    """Compute the metrics by entity type, category and length bucket in one pass.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        metrics (iterable): categories to compute, by default all of METRICS.
+        length_buckets (tuple): sorted upper bounds of the length buckets, None for exact lengths.
+    Returns:
+        Breakdown: grouped counters, see Breakdown.rows and Breakdown.to_tsv.
+    Example:
+        >>> table = breakdown(entities).rows()
+        >>> [row for row in table if row['type'] == 'Disease' and row['category'] == 'outer']
+    """
+    return Breakdown(metrics, length_buckets).update_batch(entities)
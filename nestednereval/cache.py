@@ -0,0 +1,279 @@
+"""On-disk cache of decoded and evaluated IOB2 prediction files.
+Entries are keyed by a hash of the content of the input files, the library version and the
+decoding options, so editing a file or upgrading the library never returns stale results. Each
+entry holds the pickled entities and nestings of every sentence as one zlib stream, written while
+the files are evaluated, followed by the counters of every metric as a small JSON trailer.
+Evaluating from the cache only reads the trailer, the entities and nestings are decompressed when
+they are first accessed. The cache is bounded in size and evicts the least recently used entries.
+Only point it to directories you trust, entries are unpickled when loaded.
+
+Layout: MAGIC, zlib stream of pickled (sentence, nestings) records, JSON counters, length of the
+JSON counters (uint32, little endian).
+"""
+import hashlib
+import io
+import json
+import os
+import pickle
+import struct
+import tempfile
+import zlib
+
+from nestednereval import __version__
+from nestednereval.evaluator import METRICS, EvaluationResult, Evaluator
+from nestednereval.utils import iter_iob2_prediction_file, iter_merged_iob2_files
+
+MAGIC = b'NNEC\x02'
+
+_TRAILER = struct.Struct('<I')
+
+
+class CachedEvaluation:
+    """Decoded and evaluated content of a set of IOB2 files.
+    Args:
+        entities (list(dict)): predicted and original entities of every sentence, None to load them with loader.
+        nestings (list(dict)): real and pred nestings of every sentence, None to load them with loader.
+        counts (dict): metric name -> [tp, fp, fn, support] for every metric of METRICS.
+        loader (callable): returns the (entities, nestings) lists the first time one of them is accessed.
+    """
+
+    def __init__(self, entities, nestings, counts, loader=None):
+        self._entities = entities
+        self._nestings = nestings
+        self.counts = counts
+        self._loader = loader
+
+    def _load(self):
+        if self._entities is None:
+            self._entities, self._nestings = self._loader()
+            self._loader = None
+
+    @property
+    def entities(self):
+        """Predicted and original entities of every sentence."""
+        self._load()
+        return self._entities
+
+    @property
+    def nestings(self):
+        """Real and pred nestings of every sentence."""
+        self._load()
+        return self._nestings
+
+    def result(self, metrics=None):
+        """EvaluationResult of the given metrics (all of METRICS by default)."""
+        result = EvaluationResult(METRICS if metrics is None else metrics)
+        result.add({metric: self.counts[metric] for metric in result.metrics})
+        return result
+
+
+def _read_sentences(filepaths, suffix, dedupe_real):
+    if isinstance(filepaths, (str, bytes, os.PathLike)):
+        return iter_iob2_prediction_file(filepaths, suffix=suffix)
+    return iter_merged_iob2_files(filepaths, dedupe_real=dedupe_real, suffix=suffix)
+
+
+def _records(sentences, result):
+    """Yield the (sentence, nestings) record of every sentence and add its counts to result."""
+    evaluator = Evaluator()
+    for sent in sentences:
+        real = evaluator.analyse(sent["real"])
+        pred = evaluator.analyse(sent["pred"])
+        result.add(evaluator.count_analysed(real, pred))
+        yield sent, {"real": real.nestings, "pred": pred.nestings}
+
+
+def evaluate_files(filepaths, suffix=False, dedupe_real=False):
+    """Read, decode and evaluate IOB2 files without caching.
+    Args:
+        filepaths (string or list): an IOB2 file, or the IOB2 files predicted per entity type.
+        suffix (bool): tags have the prefix at the end, see get_entities.
+        dedupe_real (bool): see iter_merged_iob2_files.
+    Returns:
+        CachedEvaluation: entities, nestings and counters of every metric.
+    """
+    result = EvaluationResult()
+    records = list(_records(_read_sentences(filepaths, suffix, dedupe_real), result))
+    return CachedEvaluation([sent for sent, _ in records], [nestings for _, nestings in records], result.counts)
+
+
+class EvaluationCache:
+    """Size bounded LRU cache of evaluated IOB2 files.
+    Args:
+        directory (string): directory of the cache entries, created if needed.
+        max_bytes (int): maximum total size of the entries, the least recently used are evicted.
+    Example:
+        >>> cache = EvaluationCache('.nestednereval_cache')
+        >>> cache.evaluate(['test_ANAT.iob2', 'test_CHEM.iob2'])['nesting']
+        >>> cache.invalidate(['test_ANAT.iob2', 'test_CHEM.iob2'])
+    """
+
+    def __init__(self, directory, max_bytes=1 << 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, filepaths, suffix=False, dedupe_real=False):
+        """Hash of the content of the files, the library version and the decoding options."""
+        single = isinstance(filepaths, (str, bytes, os.PathLike))
+        digest = hashlib.sha256()
+        digest.update(repr((__version__, single, bool(suffix), bool(dedupe_real))).encode('UTF-8'))
+        for filepath in [filepaths] if single else filepaths:
+            file_digest = hashlib.sha256()
+            with open(filepath, 'rb') as iob2_file:
+                for block in iter(lambda: iob2_file.read(1 << 20), b''):
+                    file_digest.update(block)
+            digest.update(file_digest.digest())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.nnec')
+
+    def _read_counts(self, path):
+        """Counters of an entry read from its trailer, or None. Invalid entries are removed."""
+        try:
+            with open(path, 'rb') as entry:
+                if entry.read(len(MAGIC)) != MAGIC:
+                    raise ValueError('not a cache entry')
+                entry.seek(-_TRAILER.size, os.SEEK_END)
+                length, = _TRAILER.unpack(entry.read(_TRAILER.size))
+                entry.seek(-_TRAILER.size - length, os.SEEK_END)
+                counts = json.loads(entry.read(length).decode('UTF-8'))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        os.utime(path)
+        return counts
+
+    def _read_body(self, path):
+        """(entities, nestings) lists of an entry."""
+        with open(path, 'rb') as entry:
+            entry.seek(-_TRAILER.size, os.SEEK_END)
+            length, = _TRAILER.unpack(entry.read(_TRAILER.size))
+            end = entry.tell() - _TRAILER.size - length
+            entry.seek(len(MAGIC))
+            stream = io.BytesIO(zlib.decompress(entry.read(end - len(MAGIC))))
+        entities = []
+        nestings = []
+        size = len(stream.getbuffer())
+        while stream.tell() < size:
+            sent, sent_nestings = pickle.load(stream)
+            entities.append(sent)
+            nestings.append(sent_nestings)
+        return entities, nestings
+
+    def _write(self, key, records, counts):
+        # counts is read after records is exhausted, so it may be filled while the records are produced.
+        descriptor, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as entry:
+                entry.write(MAGIC)
+                compressor = zlib.compressobj()
+                for record in records:
+                    entry.write(compressor.compress(pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)))
+                entry.write(compressor.flush())
+                trailer = json.dumps(counts).encode('UTF-8')
+                entry.write(trailer + _TRAILER.pack(len(trailer)))
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def get(self, key):
+        """Cached entry of a key, or None. Reading an entry marks it as recently used.
+        Only the counters are read, the entities and nestings are loaded when first accessed.
+        """
+        path = self._path(key)
+        counts = self._read_counts(path)
+        if counts is None:
+            return None
+        return CachedEvaluation(None, None, counts, lambda: self._read_body(path))
+
+    def put(self, key, evaluation):
+        """Store an entry and evict the least recently used entries above max_bytes."""
+        self._write(key, zip(evaluation.entities, evaluation.nestings), evaluation.counts)
+
+    def load(self, filepaths, suffix=False, dedupe_real=False):
+        """Entities, nestings and counters of IOB2 files, from the cache or computed and stored.
+        On a miss, the sentences are streamed from the files into the new entry, so the corpus is
+        never held in memory. The entities and nestings are read back when first accessed.
+        Args:
+            filepaths (string or list): an IOB2 file, or the IOB2 files predicted per entity type.
+            suffix (bool): tags have the prefix at the end, see get_entities.
+            dedupe_real (bool): see iter_merged_iob2_files.
+        Returns:
+            CachedEvaluation: entities, nestings and counters of every metric.
+        """
+        key = self.key(filepaths, suffix, dedupe_real)
+        path = self._path(key)
+        counts = self._read_counts(path)
+        if counts is None:
+            result = EvaluationResult()
+            self._write(key, _records(_read_sentences(filepaths, suffix, dedupe_real), result), result.counts)
+            counts = result.counts
+
+        def loader():
+            try:
+                return self._read_body(path)
+            except FileNotFoundError:
+                # The entry was evicted in the meantime, decode the files again.
+                evaluation = evaluate_files(filepaths, suffix, dedupe_real)
+                return evaluation.entities, evaluation.nestings
+
+        return CachedEvaluation(None, None, counts, loader)
+
+    def evaluate(self, filepaths, metrics=None, suffix=False, dedupe_real=False):
+        """EvaluationResult of IOB2 files, from the cache when possible. Only the counters are read."""
+        return self.load(filepaths, suffix, dedupe_real).result(metrics)
+
+    def _entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.nnec'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def size(self):
+        """Total size in bytes of the cache entries."""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def invalidate(self, filepaths, suffix=False, dedupe_real=False):
+        """Remove the entry of the given files and options. Returns whether it existed."""
+        try:
+            os.remove(self._path(self.key(filepaths, suffix, dedupe_real)))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def clear(self):
+        """Remove every entry of the cache."""
+        for _, _, path in self._entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,144 @@
+"""Command line evaluator of IOB2 prediction files.
+Every system is given as NAME=FILE[,FILE...], with one IOB2 file per entity type predicted for
+the same sentences. The files of a system are streamed through iter_merged_iob2_files and the
+metrics of all the systems are written as one JSON document or one TSV table.
+
+Usage:
+    nestednereval flair=flair_ANAT.iob2,flair_CHEM.iob2 bert=bert_ANAT.iob2,bert_CHEM.iob2
+    nestednereval test.iob2 --metrics standard nesting --format tsv --workers 4
+    nestednereval flair=flair_ANAT.iob2,flair_CHEM.iob2 --cache .nestednereval_cache
+    nestednereval flair=flair_ANAT.iob2,flair_CHEM.iob2 --trace trace.json
+"""
+import argparse
+import json
+import sys
+
+from nestednereval.evaluator import METRICS
+
+TSV_COLUMNS = ('system', 'metric', 'precision', 'recall', 'f1', 'support', 'tp', 'fp', 'fn')
+
+
+def parse_system(spec):
+    """Split a NAME=FILE[,FILE...] system argument into its name and filepaths.
+    Without NAME= the argument itself is used as the name.
+    """
+    name, separator, files = spec.partition('=')
+    if not separator:
+        name, files = spec, spec
+    filepaths = [filepath for filepath in files.split(',') if filepath]
+    if not name or not filepaths:
+        raise argparse.ArgumentTypeError('invalid system {!r}, expected NAME=FILE[,FILE...]'.format(spec))
+    return name, filepaths
+
+
+def evaluate_system(filepaths, metrics=None, workers=1, chunksize=1000, cache=None, suffix=False, dedupe_real=False):
+    """EvaluationResult of the IOB2 files predicted per entity type by one system.
+    Args:
+        filepaths (list): IOB2 files of the system, one per entity type.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        workers (int): number of processes the sentences are evaluated in, ignored with a cache.
+        chunksize (int): number of sentences sent to a worker at once.
+        cache (EvaluationCache): cache of evaluated files, or None. On a miss the files are
+            evaluated in this process while they are streamed into the new entry.
+        suffix (bool): tags have the prefix at the end, see get_entities.
+        dedupe_real (bool): see iter_merged_iob2_files.
+    """
+    if cache is not None:
+        return cache.evaluate(filepaths, metrics, suffix, dedupe_real)
+    from nestednereval.parallel import parallel_evaluate
+    from nestednereval.utils import iter_merged_iob2_files
+
+    sentences = iter_merged_iob2_files(filepaths, dedupe_real=dedupe_real, suffix=suffix)
+    return parallel_evaluate(sentences, workers=workers, chunksize=chunksize, metrics=metrics)
+
+
+def positive_int(value):
+    """argparse type of the integer options that must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        raise argparse.ArgumentTypeError('expected a positive integer, got {!r}'.format(value))
+    return number
+
+
+def to_tsv(results):
+    """Table with one row per system and metric, as tab separated values with a header line."""
+    lines = ['\t'.join(TSV_COLUMNS)]
+    for name, result in results.items():
+        for metric, scores in result.to_dict().items():
+            row = dict(scores, system=name, metric=metric)
+            lines.append('\t'.join(str(row[column]) for column in TSV_COLUMNS))
+    return '\n'.join(lines) + '\n'
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='nestednereval', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('systems', nargs='+', type=parse_system, metavar='NAME=FILE[,FILE...]',
+                        help='IOB2 files predicted per entity type by each system')
+    parser.add_argument('--metrics', nargs='+', choices=METRICS, help='metrics to compute (all by default)')
+    parser.add_argument('--format', choices=('json', 'tsv'), default='json', help='output format')
+    parser.add_argument('--output', help='output file (stdout by default)')
+    parser.add_argument('--workers', type=positive_int, default=1,
+                        help='processes evaluating the sentences (ignored with --cache)')
+    parser.add_argument('--chunksize', type=positive_int, default=1000, help='sentences sent to a worker at once')
+    parser.add_argument('--cache', metavar='DIRECTORY', help='cache evaluated files in this directory')
+    parser.add_argument('--cache-max-bytes', type=int, default=1 << 30, help='maximum size of the cache')
+    parser.add_argument('--suffix', action='store_true', help='tags have the prefix at the end (PER-B)')
+    parser.add_argument('--dedupe-real', action='store_true',
+                        help='keep only the first occurrence of gold entities repeated across the per-type files')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='profile the stages run in the main process and write a Chrome trace file')
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    names = [name for name, _ in args.systems]
+    if len(set(names)) != len(names):
+        parser.error('system names must be unique')
+
+    cache = None
+    if args.cache:
+        from nestednereval.cache import EvaluationCache
+        cache = EvaluationCache(args.cache, max_bytes=args.cache_max_bytes)
+        if args.workers != 1:
+            print('nestednereval: --workers is ignored with --cache, cache misses are evaluated in this process',
+                  file=sys.stderr)
+
+    profiler = None
+    if args.trace:
+        from nestednereval.profiling import Profiler
+        profiler = Profiler().enable()
+
+    results = {}
+    try:
+        for name, filepaths in args.systems:
+            results[name] = evaluate_system(filepaths, args.metrics, args.workers, args.chunksize, cache, args.suffix,
+                                            args.dedupe_real)
+    except (OSError, ValueError) as error:
+        # Missing files and mismatched per-type files are input errors, not crashes.
+        print('nestednereval: error: {}: {}'.format(name, error), file=sys.stderr)
+        return 1
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.write_trace(args.trace)
+
+    if args.format == 'json':
+        text = json.dumps({name: result.to_dict() for name, result in results.items()}, indent=2) + '\n'
+    else:
+        text = to_tsv(results)
+    if args.output:
+        with open(args.output, 'w', encoding='UTF-8') as output:
+            output.write(text)
+    else:
+        sys.stdout.write(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
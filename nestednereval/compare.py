@@ -0,0 +1,192 @@
+"""Side-by-side comparison of several systems on the same gold standard.
+The gold entities of every sentence are analysed once (nestings, flat, inner and outer
+partitions and their hash sets) in a GoldStandard, then every system only analyses its own
+predictions against it. With workers the gold analyses are sent once to every worker process and
+the predictions of all the systems are evaluated in chunks.
+
+Example:
+    >>> comparison = compare_systems(gold, {'flair': flair_pred, 'bert': bert_pred})
+    >>> print(comparison.format_table())
+    metric    flair   bert    Δ bert
+    standard  0.8421  0.8710  +0.0289
+    ...
+"""
+from itertools import islice
+from multiprocessing import Pool
+
+from nestednereval.evaluator import EvaluationResult, Evaluator, count_sentence
+from nestednereval.spans import CompactSentence
+
+SCORES = ('precision', 'recall', 'f1')
+
+
+def _side(item, side):
+    # A sentence (dict or CompactSentence), or directly the entities of one side.
+    return item[side] if isinstance(item, (dict, CompactSentence)) else item
+
+
+class GoldStandard:
+    """Gold entities of a test set, analysed once and shared by all the evaluated systems.
+    Args:
+        gold (iterable): the real entities of every sentence, as lists of (chunk_type, chunk_start,
+            chunk_end) or as sentences (dicts or CompactSentence) whose "real" entities are used.
+            Compact predictions must be packed with the vocabulary of the compact gold.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+    """
+
+    def __init__(self, gold, metrics=None):
+        self.evaluator = Evaluator(metrics)
+        self.metrics = self.evaluator.metrics
+        self.analyses = [self.evaluator.analyse(_side(sent, "real")) for sent in gold]
+
+    def __len__(self):
+        return len(self.analyses)
+
+    def evaluate(self, predictions):
+        """Evaluate the predictions of one system.
+        Args:
+            predictions (iterable): the predicted entities of every sentence, as lists of entities or
+                as sentence dicts whose "pred" entities are used.
+        Returns:
+            EvaluationResult: counts and scores of every metric.
+        """
+        result, n_predicted = self._evaluate_range(predictions, 0)
+        if n_predicted != len(self.analyses):
+            raise ValueError('Got {} predicted sentences for {} gold sentences'.format(n_predicted, len(self.analyses)))
+        return result
+
+    def _evaluate_range(self, predictions, start):
+        result = EvaluationResult(self.metrics)
+        n_predicted = 0
+        for i, pred in enumerate(predictions, start):
+            if i >= len(self.analyses):
+                raise ValueError('More predicted sentences than the {} gold sentences'.format(len(self.analyses)))
+            result.add(count_sentence(self.analyses[i], self.evaluator.analyse(_side(pred, "pred")), self.metrics))
+            n_predicted+=1
+        return result, n_predicted
+
+
+class Comparison:
+    """EvaluationResult of every system, with the differences to a baseline system.
+    Args:
+        results (dict): system name -> EvaluationResult, in display order.
+        baseline (string): name of the reference system, the first one by default.
+    """
+
+    def __init__(self, results, baseline=None):
+        if not results:
+            raise ValueError('No system to compare')
+        self.results = dict(results)
+        self.baseline = next(iter(self.results)) if baseline is None else baseline
+        if self.baseline not in self.results:
+            raise ValueError('Unknown baseline {!r}, systems: {}'.format(self.baseline, list(self.results)))
+        self.metrics = self.results[self.baseline].metrics
+
+    def __getitem__(self, name):
+        return self.results[name]
+
+    def delta(self, name, metric):
+        """(precision, recall, f1) of a system minus those of the baseline for one metric."""
+        scores = self.results[name][metric]
+        reference = self.results[self.baseline][metric]
+        return tuple(scores[i] - reference[i] for i in range(len(SCORES)))
+
+    def to_dict(self):
+        """Scores of every system and metric, see EvaluationResult.to_dict, with delta_precision,
+        delta_recall and delta_f1 relative to the baseline."""
+        table = {}
+        for name, result in self.results.items():
+            scores = result.to_dict()
+            for metric in self.metrics:
+                scores[metric].update(zip(['delta_' + score for score in SCORES], self.delta(name, metric)))
+            table[name] = scores
+        return table
+
+    def rows(self, score='f1'):
+        """Header and rows of the side-by-side table of one score.
+        Every row holds the metric, the score of every system, then the delta of every other system.
+        Returns:
+            tuple: (header, rows) lists.
+        """
+        if score not in SCORES:
+            raise ValueError('Unknown score {!r}, expected one of {}'.format(score, SCORES))
+        position = SCORES.index(score)
+        others = [name for name in self.results if name != self.baseline]
+        header = ['metric'] + list(self.results) + ['Δ ' + name for name in others]
+        rows = []
+        for metric in self.metrics:
+            row = [metric] + [self.results[name][metric][position] for name in self.results]
+            row.extend(self.delta(name, metric)[position] for name in others)
+            rows.append(row)
+        return header, rows
+
+    def format_table(self, score='f1', digits=4):
+        """The side-by-side table of one score as aligned text, deltas with an explicit sign."""
+        header, rows = self.rows(score)
+        n_systems = len(self.results)
+        cells = [header]
+        for row in rows:
+            cells.append([row[0]] + ['{:.{}f}'.format(value, digits) for value in row[1:n_systems + 1]]
+                         + ['{:+.{}f}'.format(value, digits) for value in row[n_systems + 1:]])
+        widths = [max(len(line[i]) for line in cells) for i in range(len(header))]
+        return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in cells)
+
+    def __repr__(self):
+        return 'Comparison(baseline={!r}, systems={})'.format(self.baseline, list(self.results))
+
+
+_worker_gold = None
+
+
+def _init_worker(gold):
+    global _worker_gold
+    _worker_gold = gold
+
+
+def _evaluate_chunk(task):
+    name, start, predictions = task
+    return (name,) + _worker_gold._evaluate_range(predictions, start)
+
+
+def _chunk_tasks(systems, chunksize):
+    for name, predictions in systems.items():
+        predictions = iter(predictions)
+        start = 0
+        chunk = list(islice(predictions, chunksize))
+        while chunk:
+            yield name, start, chunk
+            start+=len(chunk)
+            chunk = list(islice(predictions, chunksize))
+
+
+def compare_systems(gold, systems, metrics=None, baseline=None, workers=1, chunksize=1000):
+    """Evaluate several systems against the same gold entities, analysed only once.
+    With workers, the same main module guard as parallel_evaluate applies.
+    Args:
+        gold (iterable or GoldStandard): the real entities of every sentence, see GoldStandard.
+        systems (dict): system name -> the predicted entities of every sentence, as lists of
+            entities or as sentence dicts whose "pred" entities are used.
+        metrics (iterable): metrics to compute, by default all of METRICS. Ignored for a GoldStandard.
+        baseline (string): system the deltas are computed against, the first one by default.
+        workers (int): number of processes, 1 evaluates in this process, None uses os.cpu_count().
+        chunksize (int): number of sentences sent to a worker at once.
+    Returns:
+        Comparison: results of every system and deltas to the baseline.
+    """
+    if not isinstance(gold, GoldStandard):
+        gold = GoldStandard(gold, metrics)
+    if workers == 1:
+        return Comparison({name: gold.evaluate(predictions) for name, predictions in systems.items()}, baseline)
+    if chunksize < 1:
+        raise ValueError('chunksize must be a positive integer')
+
+    results = {name: EvaluationResult(gold.metrics) for name in systems}
+    n_sentences = dict.fromkeys(systems, 0)
+    with Pool(processes=workers, initializer=_init_worker, initargs=(gold,)) as pool:
+        for name, partial, size in pool.imap_unordered(_evaluate_chunk, _chunk_tasks(systems, chunksize)):
+            results[name].merge(partial)
+            n_sentences[name]+=size
+    for name, size in n_sentences.items():
+        if size != len(gold):
+            raise ValueError('Got {} predicted sentences of {} for {} gold sentences'.format(size, name, len(gold)))
+    return Comparison(results, baseline)
@@ -0,0 +1,76 @@
+"""Document mode: evaluation of long unsplit sequences in independent windows.
+A window boundary is only placed between two tokens that no real or predicted entity spans, so
+every entity, its overlaps and its nestings stay in one window. Matching, nestings and the
+flat/inner/outer partitions only relate overlapping entities, hence the counts summed over
+the windows are exactly the counts of the whole document.
+"""
+from bisect import bisect_right
+
+from nestednereval.parallel import parallel_evaluate
+
+
+def document_windows(real, pred, window_entities=512):
+    """Split the entities of a document into windows at entity-free token boundaries.
+    Consecutive groups of overlapping entities are packed into the same window until it holds
+    at least window_entities entities, a group larger than that is never cut.
+    Args:
+        real (list): list of (chunk_type, chunk_start, chunk_end) of the document.
+        pred (list): list of (chunk_type, chunk_start, chunk_end) of the document.
+        window_entities (int): real and predicted entities after which a window is closed at the
+            next boundary, 1 for one window per group of overlapping entities.
+    Returns:
+        list: list of dicts with the real and predicted entities of every window, in document
+        order and keeping the original token indices and the order of the entities.
+    Example:
+        >>> document_windows([("A", 0, 2), ("B", 1, 1), ("A", 5, 6)], [("A", 5, 5)], window_entities=1)
+        [{"real": [("A", 0, 2), ("B", 1, 1)], "pred": []}, {"real": [("A", 5, 6)], "pred": [("A", 5, 5)]}]
+    """
+    if window_entities < 1:
+        raise ValueError('window_entities must be a positive integer')
+    window_starts = []
+    size = 0
+    end = None
+    for span_start, span_end in sorted([(e[1], e[2]) for e in real] + [(e[1], e[2]) for e in pred]):
+        if end is None or (span_start > end and size >= window_entities):
+            window_starts.append(span_start)
+            size = 0
+            end = span_end
+        size += 1
+        end = max(end, span_end)
+
+    windows = [{"real": [], "pred": []} for _ in window_starts]
+    for side, entities in (("real", real), ("pred", pred)):
+        for e in entities:
+            windows[bisect_right(window_starts, e[1])-1][side].append(e)
+    return windows
+
+
+def iter_windows(documents, window_entities=512):
+    """Yield the windows of every document.
+    Args:
+        documents (iterable(dict)): Documents (dicts) containing predicted and original entities.
+        window_entities (int): see document_windows.
+    Yields:
+        dict: predicted and original entities of one window.
+    """
+    for document in documents:
+        yield from document_windows(document["real"], document["pred"], window_entities)
+
+
+def evaluate_documents(documents, metrics=None, workers=1, window_entities=512, chunksize=64):
+    """Compute the metrics over long documents, window by window.
+    The result is identical to evaluate_all on the unsplit documents.
+    Args:
+        documents (iterable(dict)): Documents (dicts) containing predicted and original entities,
+            e.g. iter_iob2_prediction_file on a file without sentence splits.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        workers (int): number of processes the windows are evaluated in, see parallel_evaluate.
+        window_entities (int): see document_windows.
+        chunksize (int): number of windows sent to a worker at once.
+    Returns:
+        EvaluationResult: counts and scores of every metric.
+    Example:
+        >>> evaluate_documents(iter_iob2_prediction_file('notes.iob2'), workers=4)['nesting']
+    """
+    return parallel_evaluate(iter_windows(documents, window_entities), workers=workers, chunksize=chunksize,
+                             metrics=metrics)
@@ -0,0 +1,255 @@
+"""Error analysis: index of the false positives and false negatives of every category.
+Every error is stored as one row of compact `array` columns (kind, category, sentence, type,
+start, end, nesting size and nearest counterpart), with the entity types interned, so a row
+takes about 40 bytes. With max_errors the rows are a uniform reservoir sample of all the errors,
+while the totals stay exact. Queries by type, category, kind or sentence use lazily built
+inverted indexes, other filters scan only the candidate rows.
+"""
+import random
+from array import array
+from collections import Counter, namedtuple
+
+from nestednereval.evaluator import Evaluator
+from nestednereval.matching import overlapping_pairs
+
+CATEGORIES = ('flat', 'inner', 'outer', 'nesting')
+
+KINDS = ('fp', 'fn')
+
+ErrorRecord = namedtuple('ErrorRecord', ['kind', 'category', 'sentence', 'entity', 'size', 'counterpart'])
+ErrorRecord.__doc__ = """One false positive or false negative.
+    kind: 'fp' or 'fn'.
+    category: metric family of the error (flat, inner, outer, nesting...).
+    sentence: index of the sentence.
+    entity: (type, start, end) of the entity, or of the outermost entity of a nesting.
+    size: number of entities of the nesting, 1 for entities.
+    counterpart: (type, start, end) of the overlapping entity of the other side closest to entity, or None.
+"""
+
+_COLUMNS = (('kind', 'b'), ('category', 'b'), ('sentence', 'q'), ('type', 'i'), ('start', 'q'), ('end', 'q'),
+            ('size', 'i'), ('other_type', 'i'), ('other_start', 'q'), ('other_end', 'q'))
+
+def _closeness(entity, other):
+    # Intersection over union of the spans, then same type first.
+    intersection = min(entity[2], other[2]) - max(entity[1], other[1]) + 1
+    union = max(entity[2], other[2]) - min(entity[1], other[1]) + 1
+    return intersection / union, entity[0] == other[0]
+
+
+def nearest_counterparts(real_entities, pred_entities):
+    """Closest overlapping entity of the other side of every real and predicted entity.
+    Args:
+        real_entities (list): list of (chunk_type, chunk_start, chunk_end).
+        pred_entities (list): list of (chunk_type, chunk_start, chunk_end).
+    Returns:
+        tuple: (real, pred) dicts entity -> counterpart, for the entities that overlap some counterpart.
+    """
+    real_entities = list(set(real_entities))
+    pred_entities = list(set(pred_entities))
+    real_best = {}
+    pred_best = {}
+    for i, j in overlapping_pairs([e[1:] for e in real_entities], [e[1:] for e in pred_entities]):
+        real_entity, pred_entity = real_entities[i], pred_entities[j]
+        closeness = _closeness(real_entity, pred_entity)
+        if real_entity not in real_best or closeness > real_best[real_entity][0]:
+            real_best[real_entity] = (closeness, pred_entity)
+        if pred_entity not in pred_best or closeness > pred_best[pred_entity][0]:
+            pred_best[pred_entity] = (closeness, real_entity)
+    return ({entity: best[1] for entity, best in real_best.items()},
+            {entity: best[1] for entity, best in pred_best.items()})
+
+
+class ErrorIndex:
+    """Indexed false positives and false negatives of a corpus.
+    Args:
+        metrics (iterable): categories whose errors are recorded, any of METRICS, by default CATEGORIES.
+        max_errors (int): maximum number of stored errors, a uniform sample is kept above it. None keeps all.
+        seed (int): random seed of the sampling.
+    Example:
+        >>> index = error_analysis(entities)
+        >>> index.query(category='inner', kind='fn', type='Body Part')
+        [ErrorRecord(kind='fn', category='inner', sentence=1, entity=('Body Part', 2, 2), size=1, counterpart=('Disease', 0, 2))]
+    """
+
+    def __init__(self, metrics=None, max_errors=None, seed=None):
+        self.metrics = CATEGORIES if metrics is None else tuple(metrics)
+        self.evaluator = Evaluator(self.metrics)
+        self.max_errors = max_errors
+        self._random = random.Random(seed)
+        self.columns = {name: array(typecode) for name, typecode in _COLUMNS}
+        self.types = []
+        self._type_ids = {}
+        self.totals = Counter()
+        self.n_errors = 0
+        self.n_sentences = 0
+        self._indexes = {}
+
+    def _type_id(self, type_):
+        type_id = self._type_ids.get(type_)
+        if type_id is None:
+            type_id = self._type_ids[type_] = len(self.types)
+            self.types.append(type_)
+        return type_id
+
+    def _add(self, kind, category, sentence, entity, size, counterpart):
+        self.totals[KINDS[kind], self.metrics[category]] += 1
+        self.n_errors += 1
+        row = (kind, category, sentence, self._type_id(entity[0]), entity[1], entity[2], size) + (
+            (self._type_id(counterpart[0]), counterpart[1], counterpart[2]) if counterpart else (-1, -1, -1))
+        if self.max_errors is None or len(self) < self.max_errors:
+            for (name, _), value in zip(_COLUMNS, row):
+                self.columns[name].append(value)
+        else:
+            # Reservoir sampling: the n-th error replaces a stored one with probability max_errors / n.
+            position = self._random.randrange(self.n_errors)
+            if position >= self.max_errors:
+                return
+            for (name, _), value in zip(_COLUMNS, row):
+                self.columns[name][position] = value
+        self._indexes.clear()
+
+    def update(self, real, pred, sentence=None):
+        """Record the errors of one sentence given its real and predicted entities.
+        Args:
+            real (list): original entities.
+            pred (list): predicted entities.
+            sentence (int): sentence id, by default the number of sentences seen so far.
+        """
+        if sentence is None:
+            sentence = self.n_sentences
+        self.n_sentences += 1
+        real = self.evaluator.analyse(real)
+        pred = self.evaluator.analyse(pred)
+        errors = []
+        for category, metric in enumerate(self.metrics):
+            if metric == 'nesting':
+                for nesting, key in zip(real.nestings, real.nesting_keys):
+                    if key not in pred.nesting_set:
+                        errors.append((1, category, nesting[0], len(nesting)))
+                for nesting, key in zip(pred.nestings, pred.nesting_keys):
+                    if key not in real.nesting_set:
+                        errors.append((0, category, nesting[0], len(nesting)))
+                continue
+            if metric == 'standard':
+                real_items, pred_items = real.entities, pred.entities
+            elif metric == 'nested':
+                real_items, pred_items = real.outer+real.inner, pred.outer+pred.inner
+            else:
+                real_items, pred_items = getattr(real, metric), getattr(pred, metric)
+            errors.extend((1, category, entity, 1) for entity in real_items if entity not in pred.entity_set)
+            errors.extend((0, category, entity, 1) for entity in pred_items if entity not in real.entity_set)
+        if not errors:
+            return
+        counterparts = nearest_counterparts(real.entities, pred.entities)
+        for kind, category, entity, size in errors:
+            # False negatives are real entities, their counterparts are predicted ones, and vice versa.
+            self._add(kind, category, sentence, entity, size, counterparts[1-kind].get(entity))
+
+    def update_batch(self, entities):
+        """Record the errors of a batch of sentences.
+        Args:
+            entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        """
+        for sent in entities:
+            self.update(sent["real"], sent["pred"])
+        return self
+
+    def __len__(self):
+        return len(self.columns['kind'])
+
+    def _record(self, row):
+        columns = self.columns
+        other_type = columns['other_type'][row]
+        return ErrorRecord(KINDS[columns['kind'][row]], self.metrics[columns['category'][row]],
+                           columns['sentence'][row],
+                           (self.types[columns['type'][row]], columns['start'][row], columns['end'][row]),
+                           columns['size'][row],
+                           None if other_type < 0 else (self.types[other_type], columns['other_start'][row],
+                                                        columns['other_end'][row]))
+
+    def __iter__(self):
+        return (self._record(row) for row in range(len(self)))
+
+    def _index(self, column):
+        index = self._indexes.get(column)
+        if index is None:
+            index = {}
+            for row, value in enumerate(self.columns[column]):
+                rows = index.get(value)
+                if rows is None:
+                    rows = index[value] = array('q')
+                rows.append(row)
+            self._indexes[column] = index
+        return index
+
+    def query(self, type=None, category=None, kind=None, sentence=None, min_length=None, max_length=None, limit=None):
+        """Errors matching all the given filters, in insertion order.
+        Args:
+            type (string): entity type (of the outermost entity for nestings).
+            category (string): metric family, e.g. 'inner' or 'nesting'.
+            kind (string): 'fp' or 'fn'.
+            sentence (int): sentence id.
+            min_length (int): minimum number of tokens of the entity.
+            max_length (int): maximum number of tokens of the entity.
+            limit (int): maximum number of errors returned.
+        Returns:
+            list: list of ErrorRecord.
+        """
+        filters = {}
+        if type is not None:
+            filters['type'] = self._type_ids.get(type, -1)
+        if category is not None:
+            filters['category'] = self.metrics.index(category) if category in self.metrics else -1
+        if kind is not None:
+            filters['kind'] = KINDS.index(kind)
+        if sentence is not None:
+            filters['sentence'] = sentence
+
+        # Start from the smallest inverted index, check the other filters row by row.
+        candidates = None
+        for column, value in filters.items():
+            rows = self._index(column).get(value, ())
+            if candidates is None or len(rows) < len(candidates):
+                candidates = rows
+        if candidates is None:
+            candidates = range(len(self))
+        columns = self.columns
+        starts, ends = columns['start'], columns['end']
+        checks = [(columns[column], value) for column, value in filters.items()]
+        records = []
+        for row in candidates:
+            if any(values[row] != value for values, value in checks):
+                continue
+            length = ends[row] - starts[row] + 1
+            if (min_length is not None and length < min_length) or (max_length is not None and length > max_length):
+                continue
+            records.append(self._record(row))
+            if limit is not None and len(records) >= limit:
+                break
+        return records
+
+    def group_counts(self, *fields):
+        """Number of stored errors grouped by some of 'kind', 'category', 'type', 'sentence' and 'length'.
+        Example:
+            >>> index.group_counts('category', 'kind')
+            Counter({('inner', 'fn'): 1, ('nesting', 'fn'): 1})
+        """
+        counts = Counter()
+        for record in self:
+            values = {'kind': record.kind, 'category': record.category, 'type': record.entity[0],
+                      'sentence': record.sentence, 'length': record.entity[2] - record.entity[1] + 1}
+            counts[tuple(values[field] for field in fields)] += 1
+        return counts
+
+
+def error_analysis(entities, metrics=None, max_errors=None, seed=None):
+    """Index the false positives and false negatives of a corpus.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        metrics (iterable): categories whose errors are recorded, any of METRICS, by default CATEGORIES.
+        max_errors (int): maximum number of stored errors, a uniform sample is kept above it.
+        seed (int): random seed of the sampling.
+    Returns:
+        ErrorIndex: indexed errors, see ErrorIndex.query.
+    """
+    return ErrorIndex(metrics, max_errors, seed).update_batch(entities)
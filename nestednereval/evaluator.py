@@ -0,0 +1,316 @@
+"""Single pass evaluation of all the nested NER metrics.
+Each sentence is analysed once (entities, nestings, flat, inner and outer partitions)
+and the confusion counts of every metric are filled from that analysis.
+"""
+from nestednereval import profiling
+from nestednereval.utils import get_nestings
+
+METRICS = ('standard', 'flat', 'inner', 'outer', 'nested', 'nesting')
+
+METRIC_NAMES = {
+    'standard': 'Standard metric',
+    'flat': 'Flat metric',
+    'inner': 'Inner metric',
+    'outer': 'Outer metric',
+    'nested': 'Nested metric',
+    'nesting': 'Nesting metric',
+}
+
+
+def calculate_f1_score(tp, fp, fn):
+    """Calculate F1 score using confusion matrix values.
+    Args:
+        tp (int): true positives
+        fp (int): false positives
+        fn (int): false negatives
+    Returns:
+        precision: micro average precision
+        recall: micro average recall
+        f1: micro F1 score
+    """
+    precision = tp/(tp+fp) if (tp+fp)!=0 else 0
+    recall = tp/(tp+fn) if (tp+fn)!=0 else 0
+    f1 = (2*precision*recall)/(precision+recall) if (precision+recall)!=0 else 0
+    return precision, recall, f1
+
+
+def nesting_key(nesting):
+    """Hashable canonical form of a nesting, independent of the order of its inner entities.
+    Args:
+        nesting (list): list of entities, outermost entity first.
+    Returns:
+        tuple: sorted tuple with the entities of the nesting.
+    """
+    return tuple(sorted(nesting))
+
+
+class EntityAnalysis:
+    """Nesting structure of the real or predicted entities of one sentence.
+    The entities and nestings are kept as lists, so duplicated entities are counted as many
+    times as they appear, and as frozensets for constant time membership tests.
+    Args:
+        entities (list): list of (chunk_type, chunk_start, chunk_end).
+        nestings (bool): whether to compute the nestings and the partitions derived from them.
+    """
+
+    def __init__(self, entities, nestings=True):
+        self.entities = entities
+        self.entity_set = frozenset(entities)
+        self.nestings = None
+        self.nesting_keys = None
+        self.nesting_set = None
+        self.flat = None
+        self.outer = None
+        self.inner = None
+        if nestings:
+            # Packed entities (see nestednereval.spans) compute their own nestings.
+            self.nestings = entities.nestings() if hasattr(entities, 'nestings') else get_nestings(entities)
+            self.nesting_keys = [nesting_key(nesting) for nesting in self.nestings]
+            self.nesting_set = frozenset(self.nesting_keys)
+            nested_entities = frozenset(entity for nesting in self.nestings for entity in nesting)
+            self.flat = [entity for entity in entities if entity not in nested_entities]
+            self.outer = [nesting[0] for nesting in self.nestings]
+            self.inner = [entity for nesting in self.nestings for entity in nesting[1:]]
+
+
+def _count(real_items, pred_items, real_set, pred_set):
+    tp = 0
+    fn = 0
+    for item in real_items:
+        if item in pred_set:
+            tp+=1
+        else:
+            fn+=1
+    fp = sum(1 for item in pred_items if item not in real_set)
+    return tp, fp, fn, len(real_items)
+
+
+def count_sentence(real, pred, metrics=METRICS):
+    """Compute the confusion counts of one sentence.
+    Args:
+        real (EntityAnalysis): analysis of the original entities.
+        pred (EntityAnalysis): analysis of the predicted entities.
+        metrics (tuple): metrics to count.
+    Returns:
+        dict: metric name -> (tp, fp, fn, support).
+    """
+    if profiling.active is None:
+        return _count_metrics(real, pred, metrics)
+    counts = {}
+    entities = len(real.entities) + len(pred.entities)
+    for metric in metrics:
+        with profiling.active.stage(profiling.metric_stage(metric), sentences=1, entities=entities):
+            counts.update(_count_metrics(real, pred, (metric,)))
+    return counts
+
+
+def _count_metrics(real, pred, metrics):
+    counts = {}
+    for metric in metrics:
+        if metric == 'standard':
+            tp = sum(1 for entity in pred.entities if entity in real.entity_set)
+            fn = sum(1 for entity in real.entities if entity not in pred.entity_set)
+            counts[metric] = (tp, len(pred.entities)-tp, fn, len(real.entities))
+        elif metric == 'flat':
+            counts[metric] = _count(real.flat, pred.flat, real.entity_set, pred.entity_set)
+        elif metric == 'inner':
+            counts[metric] = _count(real.inner, pred.inner, real.entity_set, pred.entity_set)
+        elif metric == 'outer':
+            counts[metric] = _count(real.outer, pred.outer, real.entity_set, pred.entity_set)
+        elif metric == 'nested':
+            counts[metric] = _count(real.outer+real.inner, pred.outer+pred.inner, real.entity_set, pred.entity_set)
+        elif metric == 'nesting':
+            counts[metric] = _count(real.nesting_keys, pred.nesting_keys, real.nesting_set, pred.nesting_set)
+    return counts
+
+
+class EvaluationResult:
+    """Confusion counts of every evaluated metric.
+    Indexing the result with a metric name returns (precision, recall, f1, support),
+    the same tuple returned by the functions in nestednereval.metrics.
+    Args:
+        metrics (tuple): evaluated metrics.
+    """
+
+    def __init__(self, metrics=METRICS):
+        self.metrics = tuple(metrics)
+        self.counts = {metric: [0, 0, 0, 0] for metric in self.metrics}
+
+    def add(self, counts):
+        """Add the counts returned by count_sentence."""
+        for metric, values in counts.items():
+            total = self.counts[metric]
+            for i, value in enumerate(values):
+                total[i]+=value
+
+    def merge(self, other):
+        """Add the counts of another EvaluationResult computed over other sentences.
+        Args:
+            other (EvaluationResult): result with the same metrics.
+        Returns:
+            EvaluationResult: self, with the counts of both results.
+        """
+        if set(other.metrics) != set(self.metrics):
+            raise ValueError('Cannot merge results of different metrics: {} and {}'.format(self.metrics, other.metrics))
+        self.add(other.counts)
+        return self
+
+    def copy(self):
+        """Independent copy of the result."""
+        result = EvaluationResult(self.metrics)
+        result.add(self.counts)
+        return result
+
+    def __getitem__(self, metric):
+        tp, fp, fn, support = self.counts[metric]
+        precision, recall, f1 = calculate_f1_score(tp, fp, fn)
+        return precision, recall, f1, support
+
+    def __iter__(self):
+        return iter(self.metrics)
+
+    def to_dict(self):
+        """Scores and confusion counts per metric.
+        Returns:
+            dict: metric name -> dict with precision, recall, f1, support, tp, fp and fn.
+        """
+        scores = {}
+        for metric in self.metrics:
+            tp, fp, fn = self.counts[metric][:3]
+            precision, recall, f1, support = self[metric]
+            scores[metric] = {'precision': precision, 'recall': recall, 'f1': f1, 'support': support,
+                              'tp': tp, 'fp': fp, 'fn': fn}
+        return scores
+
+    def __repr__(self):
+        return 'EvaluationResult({})'.format(self.counts)
+
+
+class Evaluator:
+    """Evaluate several metrics analysing each sentence only once.
+    Args:
+        metrics (iterable): metrics to compute, by default all of METRICS.
+    Example:
+        >>> evaluator = Evaluator(['standard', 'nesting'])
+        >>> result = evaluator.evaluate(entities)
+        >>> result['nesting']
+        (1.0, 0.5, 0.6666666666666666, 2)
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = METRICS if metrics is None else tuple(metrics)
+        unknown = [metric for metric in self.metrics if metric not in METRICS]
+        if unknown:
+            raise ValueError('Unknown metrics: {}. Available metrics: {}'.format(unknown, METRICS))
+        self.needs_nestings = any(metric != 'standard' for metric in self.metrics)
+
+    def analyse(self, entities):
+        """Analyse the real or predicted entities of one sentence."""
+        return EntityAnalysis(entities, nestings=self.needs_nestings)
+
+    def count(self, real, pred):
+        """Confusion counts of one sentence given its real and predicted entities."""
+        return count_sentence(self.analyse(real), self.analyse(pred), self.metrics)
+
+    def count_analysed(self, real, pred):
+        """Confusion counts of one sentence given the analyses of its real and predicted entities."""
+        return count_sentence(real, pred, self.metrics)
+
+    def evaluate(self, entities):
+        """Evaluate the metrics over all the sentences.
+        Args:
+            entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        Returns:
+            EvaluationResult: counts and scores of every metric.
+        """
+        result = EvaluationResult(self.metrics)
+        for sent in entities:
+            result.add(self.count(sent["real"], sent["pred"]))
+        return result
+
+
+def evaluate_all(entities, metrics=None):
+    """Compute all the metrics (or the given subset) in a single pass over the sentences.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+    Returns:
+        EvaluationResult: counts and scores of every metric.
+    Example:
+        >>> result = evaluate_all(entities)
+        >>> result['standard']
+        (1.0, 0.8, 0.888888888888889, 5)
+    """
+    return Evaluator(metrics).evaluate(entities)
+
+
+class MetricAccumulator:
+    """Running evaluation for online settings, such as evaluating during training or monitoring.
+    Only the integer counters behind calculate_f1_score are kept, so memory does not grow with
+    the number of sentences.
+    Args:
+        metrics (iterable): metrics to compute, by default all of METRICS.
+    Example:
+        >>> accumulator = MetricAccumulator()
+        >>> for sent in entities:
+        ...     accumulator.update(sent["real"], sent["pred"])
+        >>> accumulator.compute()['standard']
+        (1.0, 0.8, 0.888888888888889, 5)
+    """
+
+    def __init__(self, metrics=None):
+        self.evaluator = Evaluator(metrics)
+        self.metrics = self.evaluator.metrics
+        self.reset()
+
+    def update(self, real, pred):
+        """Add the counts of one sentence given its real and predicted entities."""
+        self._result.add(self.evaluator.count(real, pred))
+        self.n_sentences+=1
+
+    def update_batch(self, entities):
+        """Add the counts of a batch of sentences.
+        Args:
+            entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        """
+        for sent in entities:
+            self.update(sent["real"], sent["pred"])
+
+    def update_arrays(self, real_labels, pred_labels, label_map, lengths=None, mask=None, suffix=False):
+        """Add the counts of a batch of padded label-id arrays, see nestednereval.batch.batch_entities.
+        Args:
+            real_labels (array): gold label ids, integer array of shape (batch, seq_len, n_types) or (batch, seq_len).
+            pred_labels (array): predicted label ids, same shape as real_labels.
+            label_map (list): tag string of every label id, or one such list per type column.
+            lengths (array): length of every sequence, the full seq_len by default.
+            mask (array): boolean (batch, seq_len) array of the real tokens, instead of lengths.
+            suffix (bool): tags have the prefix at the end (PER-B instead of B-PER).
+        """
+        from nestednereval.batch import batch_entities
+
+        self.update_batch(batch_entities(real_labels, pred_labels, label_map, lengths, mask, suffix))
+
+    def compute(self):
+        """Scores over all the sentences seen since the last reset.
+        Returns:
+            EvaluationResult: copy of the current counts, later updates do not modify it.
+        """
+        return self._result.copy()
+
+    def reset(self):
+        """Forget all the sentences seen so far."""
+        self._result = EvaluationResult(self.metrics)
+        self.n_sentences = 0
+
+    def merge(self, other):
+        """Add the counts of another accumulator (or EvaluationResult), e.g. from another process.
+        Args:
+            other (MetricAccumulator or EvaluationResult): counts over other sentences.
+        Returns:
+            MetricAccumulator: self, with the counts of both.
+        """
+        if isinstance(other, MetricAccumulator):
+            self.n_sentences+=other.n_sentences
+            other = other._result
+        self._result.merge(other)
+        return self
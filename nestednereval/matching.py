@@ -0,0 +1,201 @@
+"""Relaxed matching of entities, with the SemEval 2013 strict/exact/partial/type modes.
+Entities are (type, start, end) with any integer offsets, token indices or character offsets,
+so spans produced by different tokenisers can be compared directly. Overlapping real and
+predicted spans are enumerated with a sorted interval sweep, in O((n + m) log(n + m) + k) per
+sentence for k overlapping pairs instead of comparing all the n * m pairs.
+
+Overlapping real and predicted entities are matched one to one, greedily by decreasing credit
+as in SemEval 2013, and both entities of a matched pair get its credit, from 0 to 1:
+    strict: same boundaries and type.
+    exact: same boundaries, any type.
+    partial: 1 with the same boundaries, 0.5 when the spans overlap, any type.
+    type: overlapping spans of the same type.
+    overlap: overlapping spans of the same type, credited with the intersection over union of the spans.
+Nestings are matched the same way, with the lowest credit of their members against a nesting of
+the same size, aligned by position. As in nestednereval.evaluator, tp is the credit of the real
+items (pred items for the standard metric), fn the rest of the real items and fp the uncredited
+part of the predicted items. So precision and recall share the same matched credit, and in strict
+mode the counts are identical to the exact metrics.
+"""
+from heapq import heappop, heappush
+
+from nestednereval.evaluator import EvaluationResult, Evaluator
+
+MODES = ('strict', 'exact', 'partial', 'type', 'overlap')
+
+SEMEVAL_MODES = ('strict', 'exact', 'partial', 'type')
+
+
+def overlapping_pairs(real_spans, pred_spans, end_inclusive=True):
+    """Yield the index pairs of the overlapping real and predicted spans.
+    Args:
+        real_spans (list): list of (start, end).
+        pred_spans (list): list of (start, end).
+        end_inclusive (bool): ends are the last position of the span (token indices) instead of
+            the position after it (character offsets).
+    Yields:
+        tuple: (i, j) for every real_spans[i] overlapping pred_spans[j], each pair once.
+    """
+    events = sorted([(start, 0, i, end) for i, (start, end) in enumerate(real_spans)] +
+                    [(start, 1, j, end) for j, (start, end) in enumerate(pred_spans)])
+    # Heaps of (end, index) of the spans already started, one per side.
+    active = ([], [])
+    for start, side, index, end in events:
+        others = active[1-side]
+        # A span that started before and still covers start overlaps the new span.
+        while others and (others[0][0] < start if end_inclusive else others[0][0] <= start):
+            heappop(others)
+        for _, other in others:
+            yield (index, other) if side == 0 else (other, index)
+        heappush(active[side], (end, index))
+
+
+def span_credit(real_entity, pred_entity, mode='partial', end_inclusive=True):
+    """Credit of a predicted entity for a real entity under a matching mode.
+    Args:
+        real_entity (tuple): (type, start, end).
+        pred_entity (tuple): (type, start, end).
+        mode (string): one of MODES.
+        end_inclusive (bool): see overlapping_pairs.
+    Returns:
+        float: credit between 0 and 1.
+    """
+    real_type, real_start, real_end = real_entity
+    pred_type, pred_start, pred_end = pred_entity
+    # Only the exact and partial modes ignore the type.
+    if mode not in ('exact', 'partial') and real_type != pred_type:
+        return 0
+    if real_start == pred_start and real_end == pred_end:
+        return 1
+    if mode in ('strict', 'exact'):
+        return 0
+    extra = 1 if end_inclusive else 0
+    intersection = min(real_end, pred_end) - max(real_start, pred_start) + extra
+    if intersection <= 0:
+        return 0
+    if mode == 'partial':
+        return 0.5
+    if mode == 'type':
+        return 1
+    union = max(real_end, pred_end) - min(real_start, pred_start) + extra
+    return intersection / union
+
+
+def _member_order(entity):
+    return entity[1], -entity[2], entity[0]
+
+
+class RelaxedEvaluator(Evaluator):
+    """Evaluate the metrics with relaxed matching, analysing and sweeping each sentence once.
+    Args:
+        mode (string): one of MODES.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        end_inclusive (bool): see overlapping_pairs, False for character offsets.
+    Example:
+        >>> evaluator = RelaxedEvaluator('partial', end_inclusive=False)
+        >>> evaluator.evaluate([{"real": [("PER", 0, 12)], "pred": [("PER", 0, 6)]}])['standard']
+        (0.5, 0.5, 0.5, 1)
+    """
+
+    def __init__(self, mode='partial', metrics=None, end_inclusive=True):
+        if mode not in MODES:
+            raise ValueError('Unknown matching mode: {}. Available modes: {}'.format(mode, MODES))
+        super().__init__(metrics)
+        self.mode = mode
+        self.end_inclusive = end_inclusive
+
+    def credit(self, real_entity, pred_entity):
+        """Credit of a predicted entity for a real entity, see span_credit."""
+        return span_credit(real_entity, pred_entity, self.mode, self.end_inclusive)
+
+    def _credits(self, real_items, pred_items, real_spans, pred_spans, pair_credit):
+        """Credit of every real and predicted item after matching them one to one.
+        Only overlapping spans can match, the pairs are taken by decreasing credit (then in item
+        order) and each item is matched at most once.
+        """
+        pairs = []
+        for i, j in overlapping_pairs(real_spans, pred_spans, self.end_inclusive):
+            credit = pair_credit(real_items[i], pred_items[j])
+            if credit > 0:
+                pairs.append((-credit, i, j))
+        pairs.sort()
+        real_credit = [0] * len(real_items)
+        pred_credit = [0] * len(pred_items)
+        for credit, i, j in pairs:
+            if not real_credit[i] and not pred_credit[j]:
+                real_credit[i] = pred_credit[j] = -credit
+        return real_credit, pred_credit
+
+    def _nesting_credit(self, real_nesting, pred_nesting):
+        if len(real_nesting) != len(pred_nesting):
+            return 0
+        return min(self.credit(real_entity, pred_entity) for real_entity, pred_entity in zip(real_nesting, pred_nesting))
+
+    def count_analysed(self, real, pred):
+        """Relaxed confusion counts of one sentence given the analyses of its real and predicted entities."""
+        # Sorted so that ties between pairs of equal credit are broken the same way in every run.
+        real_entities = sorted(set(real.entities))
+        pred_entities = sorted(set(pred.entities))
+        real_credit, pred_credit = self._credits(real_entities, pred_entities, [entity[1:] for entity in real_entities],
+                                                 [entity[1:] for entity in pred_entities], self.credit)
+        real_credit = dict(zip(real_entities, real_credit))
+        pred_credit = dict(zip(pred_entities, pred_credit))
+
+        counts = {}
+        for metric in self.metrics:
+            if metric == 'standard':
+                tp = sum(pred_credit[entity] for entity in pred.entities)
+                found = sum(real_credit[entity] for entity in real.entities)
+                counts[metric] = (tp, len(pred.entities)-tp, len(real.entities)-found, len(real.entities))
+                continue
+            if metric == 'nesting':
+                # Nestings can only match when their outer entities overlap, so the sweep runs on the outer spans.
+                real_items, pred_items = self._credits([sorted(nesting, key=_member_order) for nesting in real.nestings],
+                                                       [sorted(nesting, key=_member_order) for nesting in pred.nestings],
+                                                       [entity[1:] for entity in real.outer],
+                                                       [entity[1:] for entity in pred.outer], self._nesting_credit)
+            else:
+                real_items = [real_credit[entity] for entity in (real.outer+real.inner if metric == 'nested' else getattr(real, metric))]
+                pred_items = [pred_credit[entity] for entity in (pred.outer+pred.inner if metric == 'nested' else getattr(pred, metric))]
+            tp = sum(real_items)
+            counts[metric] = (tp, len(pred_items)-sum(pred_items), len(real_items)-tp, len(real_items))
+        return counts
+
+    def count(self, real, pred):
+        """Relaxed confusion counts of one sentence given its real and predicted entities."""
+        return self.count_analysed(self.analyse(real), self.analyse(pred))
+
+
+def relaxed_evaluate(entities, mode='partial', metrics=None, end_inclusive=True):
+    """Compute the metrics with relaxed matching in a single pass over the sentences.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        mode (string): one of MODES.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        end_inclusive (bool): see overlapping_pairs, False for character offsets.
+    Returns:
+        EvaluationResult: counts (float in the partial and overlap modes) and scores of every metric.
+    Example:
+        >>> relaxed_evaluate(entities, 'type')['nested']
+    """
+    return RelaxedEvaluator(mode, metrics, end_inclusive).evaluate(entities)
+
+
+def semeval_evaluate(entities, metrics=None, end_inclusive=True):
+    """Results of the four SemEval 2013 modes.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        end_inclusive (bool): see overlapping_pairs, False for character offsets.
+    Returns:
+        dict: mode -> EvaluationResult, for strict, exact, partial and type.
+    """
+    evaluators = [RelaxedEvaluator(mode, metrics, end_inclusive) for mode in SEMEVAL_MODES]
+    results = {mode: EvaluationResult(evaluators[0].metrics) for mode in SEMEVAL_MODES}
+    for sent in entities:
+        # The analysis does not depend on the mode, so it is shared by the four evaluators.
+        real = evaluators[0].analyse(sent["real"])
+        pred = evaluators[0].analyse(sent["pred"])
+        for mode, evaluator in zip(SEMEVAL_MODES, evaluators):
+            results[mode].add(evaluator.count_analysed(real, pred))
+    return results
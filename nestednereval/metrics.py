@@ -3,68 +3,40 @@ These metrics are still part of a work in progress, so they have not yet
 been officially published as a library.
 """
 
-from nestednereval.utils import get_nestings
-import numpy as np
+from nestednereval.utils import entity_tuples, get_nestings
+from nestednereval.evaluator import METRICS, METRIC_NAMES, calculate_f1_score, evaluate_all
 from collections import defaultdict
-
-def calculate_f1_score(tp, fp, fn):
-  """Calculate F1 score using confusion matrix values.
-    Args:
-        tp (int): true positives 
-        fp (int): false positives
-        fn (int): false negatives
-    Returns:
-        precision: micro average precision
-        recall: micro average recall
-        f1: micro F1 score
-    """
-  precision = tp/(tp+fp) if (tp+fp)!=0 else 0
-  recall = tp/(tp+fn) if (tp+fn)!=0 else 0
-  f1 = (2*precision*recall)/(precision+recall) if (precision+recall)!=0 else 0
-  return precision, recall, f1
+from bisect import bisect_left
 
 def standard_metric(entities):
   """Calculate standard nested NER metric, which corresponds to the micro F1 score.
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
     Returns:
         precision (int): micro average precision
         recall (int): micro average recall
         f1 (int): micro F1 score
         support (int): number of samples in partition
     """
-  tp = 0
-  fn = 0
-  fp = 0
-  support = 0
+  return evaluate_all(entities, ['standard'])['standard']
 
-  for sent in entities:
-    p = sent["pred"]
-    g = sent["real"]
-
-    for entity in p: 
-        if entity in g: 
-            tp+=1
-        if entity not in g:
-            fp+=1
-
-    for entity in g:
-        support+=1
-        if entity not in p:
-            fn+=1
-  
-  precision, recall, f1 = calculate_f1_score(tp, fp, fn)
-  return precision, recall, f1, support
 
 def length_metric(entities):
-  
+  """Calculate the fraction of original entities correctly predicted per entity length.
+    Per type and per category length tables with precision, recall and F1 are computed by
+    nestednereval.breakdown.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+    Returns:
+        dict: entity length -> recall, sorted by length.
+    """
 
   entities_length_accuracy = defaultdict(int)
   support = defaultdict(int)
 
   for sent in entities:
-    p = sent["pred"]
-    g = sent["real"]
+    p = frozenset(entity_tuples(sent["pred"]))
+    g = entity_tuples(sent["real"])
 
 
     for entity in g:
@@ -78,8 +50,6 @@ def length_metric(entities):
   for k, v in entities_length_accuracy.items():
     entities_length_accuracy[k] = v/support[k]
 
-  print(support)
-
   entities_length_accuracy = dict(sorted(entities_length_accuracy.items(), key=lambda item: item[0]))
  
 
@@ -89,80 +59,86 @@ def length_metric(entities):
 def nesting_metric(entities):
   """Calculate micro F1 score over complete nestings (detecting inner and outer entities simultaneously).
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
     Returns:
         precision (int): micro average precision
         recall (int): micro average recall
         f1 (int): micro F1 score
         support (int): number of samples in partition
     """
-  
-  tp = 0
-  fn = 0
-  fp = 0
-  support = 0
-
-  for sent in entities:
-    pred_nestings = get_nestings(sent["pred"])
-    test_nestings = get_nestings(sent["real"])
-    
-    for nesting in test_nestings:
-      support+=1
-      if nesting in pred_nestings:
-        tp+=1
-      else:
-        fn+=1
-
-    for nesting in pred_nestings:
-      if nesting not in test_nestings:
-        fp+=1
-  
-  precision, recall, f1 = calculate_f1_score(tp, fp, fn)
-  return precision, recall, f1, support
+  return evaluate_all(entities, ['nesting'])['nesting']
 
 
-
-def get_nestings_per_level(nestings):
+def get_nesting_depths(nesting):
+  """Calculate the depth of every entity of a nesting in one sweep over its sorted spans.
+    The depth of an entity is the length of the longest chain of entities of the nesting strictly
+    containing it, so the outermost entities have depth 0.
+    Args:
+        nesting (list): list of entities (chunk_type, chunk_start, chunk_end).
+    Returns:
+        list: depth of each entity, in the order of the nesting.
+    """
+  depth_per_span = {}
+  # Staircase of the spans seen so far: ends increase while depths decrease, so the deepest
+  # span reaching a given end is the first one with end >= that end.
+  ends = []
+  depths = []
+  for start, end in sorted({(e[1], e[2]) for e in nesting}, key=lambda span: (span[0], -span[1])):
+    pos = bisect_left(ends, end)
+    depth = depths[pos]+1 if pos < len(ends) else 0
+    hi = pos+1 if pos < len(ends) and ends[pos]==end else pos
+    lo = pos
+    while lo > 0 and depths[lo-1] <= depth:
+      lo-=1
+    ends[lo:hi] = [end]
+    depths[lo:hi] = [depth]
+    depth_per_span[(start, end)] = depth
+  return [depth_per_span[(e[1], e[2])] for e in nesting]
+
+
+def get_nestings_per_level(nestings, max_level=1):
+  """Group the entities of the nestings by nesting level without modifying the nestings.
+    Args:
+        nestings (list): nestings returned by get_nestings.
+        max_level (int): deeper levels are collapsed into this one. None keeps every depth.
+    Returns:
+        defaultdict(list): level -> entities, in nesting order and by increasing depth.
+    """
   nestings_per_level = defaultdict(list)
 
   for nesting in nestings:
     entities_level = defaultdict(list)
-    lvl = 0
-    while(len(nesting)!=0):
-      for entity1 in nesting:
-        is_nested = False
-
-        for entity2 in nesting:
-          if entity1!=entity2:
-            if (entity1[1]>entity2[1] and entity1[2]<=entity2[2]) or (entity1[1]>=entity2[1] and entity1[2]<entity2[2]):
-          
-              is_nested = True
-
-        if not is_nested:
-          entities_level[lvl].append(entity1)
-      
-      for e in entities_level[lvl]:
-        nesting.remove(e)
-      lvl+=1
-
-
-    for k, v in entities_level.items():
-      if k==0:
-        for e in v:
-          nestings_per_level[0].append(e)
-      else:
-        for e in v:
-          nestings_per_level[1].append(e)
+    for entity, depth in zip(nesting, get_nesting_depths(nesting)):
+      entities_level[depth].append(entity)
+
+    for k in sorted(entities_level):
+      level = k if max_level is None else min(k, max_level)
+      nestings_per_level[level].extend(entities_level[k])
 
-    
   return nestings_per_level
-  
 
 
-def nesting_level_metric_relaxed(entities):
+def nesting_depth_histogram(entities, side="real"):
+  """Count the entities of the nestings per depth.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        side (str): "real" or "pred".
+    Returns:
+        dict: depth -> number of entities, sorted by depth.
+    """
+  histogram = defaultdict(int)
+  for sent in entities:
+    for nesting in get_nestings(sent[side]):
+      for depth in get_nesting_depths(nesting):
+        histogram[depth]+=1
+  return dict(sorted(histogram.items()))
+
+
+def nesting_level_metric_relaxed(entities, max_level=1):
   """Calculate micro F1 score over each level of nesting.
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        max_level (int): deeper levels are collapsed into this one. None keeps every depth.
     Returns: ToDO
     """
 
@@ -170,18 +146,19 @@ def nesting_level_metric_relaxed(entities):
   accuracy_dict = defaultdict(int)
 
   for sent in entities:
-    pred_nestings = get_nestings(sent["pred"])
+    pred_entities = entity_tuples(sent["pred"])
+    pred_nestings = get_nestings(pred_entities)
     test_nestings = get_nestings(sent["real"])
   
 
-    pred_levels = get_nestings_per_level(pred_nestings)
-    test_levels = get_nestings_per_level(test_nestings)
-
+    pred_levels = get_nestings_per_level(pred_nestings, max_level)
+    test_levels = get_nestings_per_level(test_nestings, max_level)
+    pred_entities = frozenset(pred_entities)
 
     for k, v in test_levels.items():
       for e in v:
         support[k]+=1
-        if e in sent["pred"]:
+        if e in pred_entities:
           accuracy_dict[k]+=1
     
   for k, v in accuracy_dict.items():
@@ -192,10 +169,11 @@ def nesting_level_metric_relaxed(entities):
   return accuracy_dict
 
 
-def nesting_level_metric_strict(entities):
+def nesting_level_metric_strict(entities, max_level=1):
   """Calculate micro F1 score over each level of nesting.
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        max_level (int): deeper levels are collapsed into this one. None keeps every depth.
     Returns: ToDO
     """
 
@@ -208,14 +186,13 @@ def nesting_level_metric_strict(entities):
     test_nestings = get_nestings(sent["real"])
   
 
-    pred_levels = get_nestings_per_level(pred_nestings)
-    test_levels = get_nestings_per_level(test_nestings)
-
+    pred_levels = {k: frozenset(v) for k, v in get_nestings_per_level(pred_nestings, max_level).items()}
+    test_levels = get_nestings_per_level(test_nestings, max_level)
 
     for k, v in test_levels.items():
       for e in v:
         support[k]+=1
-        if e in pred_levels[k]:
+        if e in pred_levels.get(k, ()):
           accuracy_dict[k]+=1
     
   for k, v in accuracy_dict.items():
@@ -228,183 +205,64 @@ def nesting_level_metric_strict(entities):
 def flat_metric(entities):
   """Calculate micro F1 score over flat entities (not involved in any nesting).
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
     Returns:
         precision (int): micro average precision
         recall (int): micro average recall
         f1 (int): micro F1 score
         support (int): number of samples in partition
     """
-  tp = 0
-  fn = 0
-  fp = 0
-  support = 0
-
-  for sent in entities:
-    pred_nestings = get_nestings(sent["pred"])
-    pred_flat_entities = []
-    for entity in sent["pred"]:
-      is_nested = False
-      for nesting in pred_nestings:
-        if entity in nesting:
-          is_nested = True
-      if not is_nested:
-        pred_flat_entities.append(entity)
-    
-    test_nestings = get_nestings(sent["real"])
-    test_flat_entities = []
-    for entity in sent["real"]:
-      is_nested = False
-      for nesting in test_nestings:
-        if entity in nesting:
-          is_nested = True
-      if not is_nested:
-        test_flat_entities.append(entity)
-
-    for entity in test_flat_entities:
-      support+=1
-      if entity in sent["pred"]:
-        tp+=1
-      else:
-        fn+=1
-
-    for entity in pred_flat_entities:
-      if entity not in sent["real"]:
-        fp+=1
-
-  precision, recall, f1 = calculate_f1_score(tp, fp, fn)
-  return precision, recall, f1, support
+  return evaluate_all(entities, ['flat'])['flat']
 
 
 def outer_metric(entities):
   """Calculate micro F1 score over outermost entities involved in nestings (longer entities).
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
     Returns:
         precision (int): micro average precision
         recall (int): micro average recall
         f1 (int): micro F1 score
         support (int): number of samples in partition
     """
-  tp = 0
-  fn = 0
-  fp = 0
-  support = 0
-  for sent in entities:
-    pred_nestings = get_nestings(sent["pred"])
-    test_nestings = get_nestings(sent["real"])
-    
-    for nesting in test_nestings:
-      support+=1
-      if nesting[0] in sent["pred"]:
-        tp+=1
-      else:
-        fn+=1
-
-    for nesting in pred_nestings:
-      if nesting[0] not in sent["real"]:
-        fp+=1
-  
-  precision, recall, f1 = calculate_f1_score(tp, fp, fn)
-  return precision, recall, f1, support
+  return evaluate_all(entities, ['outer'])['outer']
 
 
 def inner_metric(entities):
   """Calculate micro F1 score over inner entities (nested in other entities).
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
     Returns:
         precision (int): micro average precision
         recall (int): micro average recall
         f1 (int): micro F1 score
         support (int): number of samples in partition
     """
-  support = 0
-  tp = 0
-  fn = 0
-  fp = 0
-
-  for sent in entities:
-    pred_nestings = get_nestings(sent["pred"])
-    test_nestings = get_nestings(sent["real"])
-
-    for nesting in test_nestings:
-      for entity in nesting[1:]:
-        support+=1
-        if entity in sent["pred"]:
-          tp+=1
-        else:
-          fn+=1
-
-    for nesting in pred_nestings:
-      for entity in nesting[1:]:
-        if entity not in sent["real"]:
-          fp+=1
-
-  precision, recall, f1 = calculate_f1_score(tp, fp, fn)
-  return precision, recall, f1, support
-
+  return evaluate_all(entities, ['inner'])['inner']
 
 
 def nested_metric(entities):
   """Calculate micro F1 score over nested entities (inner or outer entities).
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
     Returns:
         precision (int): micro average precision
         recall (int): micro average recall
         f1 (int): micro F1 score
         support (int): number of samples in partition
     """
-  tp = 0
-  fn = 0
-  fp = 0
-  support = 0
+  return evaluate_all(entities, ['nested'])['nested']
 
-  for sent in entities:
-    pred_nestings = get_nestings(sent["pred"])
-    test_nestings = get_nestings(sent["real"])
-    
-    for nesting in test_nestings:
-      for entity in nesting:
-        support+=1
-        if entity in sent["pred"]:
-          tp+=1
-        else:
-          fn+=1
-
-    for nesting in pred_nestings:
-      for entity in nesting:
-        if entity not in sent["real"]:
-          fp+=1
-    
-  precision, recall, f1 = calculate_f1_score(tp, fp, fn)
-  return precision, recall, f1, support
 
 def nested_ner_metrics(entities):
     """Print all the metrics described above
     Args:
-        entities (list(dict)): List of dicts containing predicted and original entities.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
     Returns:
-        None
+        EvaluationResult: counts and scores of every metric (see nestednereval.evaluator).
     """
-    standard_precision, standard_recall, standard_f1, support = standard_metric(entities)
-    print(f'Standard metric\tPrecision: {np.round(standard_precision*100,2)}\tRecall: {np.round(standard_recall*100,2)}\tF1-Score: {np.round(standard_f1*100,2)}\tsupport: {support}')
-    
-    flat_precision, flat_recall, flat_f1, support = flat_metric(entities)
-    print(f'Flat metric\tPrecision: {np.round(flat_precision*100,2)}\tRecall: {np.round(flat_recall*100,2)}\tF1-Score: {np.round(flat_f1*100,2)}\tsupport: {support}')
-    
-    inner_precision, inner_recall, inner_f1, support = inner_metric(entities)
-    print(f'Inner metric\tPrecision: {np.round(inner_precision*100,2)}\tRecall: {np.round(inner_recall*100,2)}\tF1-Score: {np.round(inner_f1*100,2)}\tsupport: {support}')
-    
-    outer_precision, outer_recall, outer_f1, support = outer_metric(entities)
-    print(f'Outer metric\tPrecision: {np.round(outer_precision*100,2)}\tRecall: {np.round(outer_recall*100,2)}\tF1-Score: {np.round(outer_f1*100,2)}\tsupport: {support}')
-    
-    nested_precision, nested_recall, nested_f1, support = nested_metric(entities)
-    print(f'Nested metric\tPrecision: {np.round(nested_precision*100,2)}\tRecall: {np.round(nested_recall*100,2)}\tF1-Score: {np.round(nested_f1*100,2)}\tsupport: {support}')
-    
-    nesting_precision, nesting_recall, nesting_f1, support = nesting_metric(entities)
-    print(f'Nesting metric\tPrecision: {np.round(nesting_precision*100,2)}\tRecall: {np.round(nesting_recall*100,2)}\tF1-Score: {np.round(nesting_f1*100,2)}\tsupport: {support}')
-    
-
-    
\ No newline at end of file
+    result = evaluate_all(entities)
+    for metric in METRICS:
+        precision, recall, f1, support = result[metric]
+        print(f'{METRIC_NAMES[metric]}\tPrecision: {round(precision*100,2)}\tRecall: {round(recall*100,2)}\tF1-Score: {round(f1*100,2)}\tsupport: {support}')
+    return result
@@ -0,0 +1,84 @@
+"""Evaluation sharded over a pool of processes.
+Sentences are independent, so each worker evaluates a chunk of sentences (or a whole IOB2 file)
+and only ships back the integer counters of every metric, which are summed exactly.
+"""
+import os
+from itertools import islice
+from multiprocessing import Pool
+
+from nestednereval.evaluator import Evaluator, EvaluationResult
+from nestednereval.utils import iter_iob2_prediction_file, iter_merged_iob2_files
+
+
+def _is_path(item):
+    return isinstance(item, (str, bytes, os.PathLike))
+
+
+def _is_file_task(item):
+    # A filepath, or the filepaths of the IOB2 files predicted per entity type for one corpus.
+    return _is_path(item) or (isinstance(item, (list, tuple)) and bool(item) and all(_is_path(path) for path in item))
+
+
+def _chunks(entities, chunksize):
+    entities = iter(entities)
+    chunk = list(islice(entities, chunksize))
+    while chunk:
+        yield chunk
+        chunk = list(islice(entities, chunksize))
+
+
+def _evaluate_sentences(task):
+    metrics, sentences = task
+    return Evaluator(metrics).evaluate(sentences)
+
+
+def _evaluate_file(task):
+    metrics, filepaths, suffix, dedupe_real = task
+    if _is_path(filepaths):
+        return Evaluator(metrics).evaluate(iter_iob2_prediction_file(filepaths, suffix))
+    return Evaluator(metrics).evaluate(iter_merged_iob2_files(filepaths, dedupe_real=dedupe_real, suffix=suffix))
+
+
+def parallel_evaluate(entities_or_paths, workers=None, chunksize=1000, metrics=None, suffix=False, dedupe_real=False):
+    """Compute the metrics over a pool of processes.
+    The counters are integers, so the result is identical to evaluate_all on the same sentences.
+    As with any multiprocessing code, call it under an `if __name__ == '__main__':` guard on
+    platforms that spawn processes.
+    Args:
+        entities_or_paths: iterable of sentences (dicts containing predicted and original entities),
+            or a filepath / list of filepaths of IOB2 files, each one evaluated by one worker. An item
+            of the list can also be a list with the IOB2 files predicted per entity type for the same
+            sentences, which are merged with iter_merged_iob2_files.
+        workers (int): number of processes, os.cpu_count() by default. With 1 no pool is created.
+        chunksize (int): number of sentences sent to a worker at once.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        suffix (bool): tags of the IOB2 files have the prefix at the end, see get_entities.
+        dedupe_real (bool): see iter_merged_iob2_files, for the IOB2 files predicted per entity type.
+    Returns:
+        EvaluationResult: counts and scores of every metric.
+    """
+    evaluator = Evaluator(metrics)
+    metrics = evaluator.metrics
+    if chunksize < 1:
+        raise ValueError('chunksize must be a positive integer')
+
+    if _is_path(entities_or_paths):
+        entities_or_paths = [entities_or_paths]
+    if isinstance(entities_or_paths, (list, tuple)) and entities_or_paths and all(_is_file_task(item) for item in entities_or_paths):
+        function = _evaluate_file
+        tasks = ((metrics, filepaths, suffix, dedupe_real) for filepaths in entities_or_paths)
+    else:
+        function = _evaluate_sentences
+        tasks = ((metrics, chunk) for chunk in _chunks(entities_or_paths, chunksize))
+
+    result = EvaluationResult(metrics)
+    if workers == 1:
+        for task in tasks:
+            result.merge(function(task))
+        return result
+
+    with Pool(processes=workers) as pool:
+        for partial in pool.imap_unordered(function, tasks):
+            result.merge(partial)
+    return result
+
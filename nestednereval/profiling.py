@@ -0,0 +1,178 @@
+"""Opt-in timing instrumentation of the evaluation pipeline.
+The reading, decoding, merging, nestings and metric stages check the module attribute `active`
+and only measure anything while a Profiler is enabled, so the cost when disabled is one
+attribute lookup per call. Each profiler keeps per stage totals (calls, wall time, sentences and
+entities) and optionally the individual spans as Chrome trace events, which can be opened with
+chrome://tracing, Perfetto or speedscope.
+
+Profilers only see the current process: with workers > 1 the stages run in the workers are not
+recorded.
+
+Example:
+    >>> with Profiler() as profiler:
+    ...     evaluate_all(iter_merged_iob2_files(['test_ANAT.iob2', 'test_CHEM.iob2']))
+    >>> profiler.summary()['decoding']['calls']
+    >>> profiler.write_trace('trace.json')
+"""
+import json
+import os
+import threading
+from time import perf_counter
+
+# Innermost enabled Profiler, or None when profiling is disabled.
+active = None
+
+_stack = []
+
+STAGES = ('reading', 'decoding', 'merging', 'nestings')
+
+
+def metric_stage(metric):
+    """Stage name of a metric, e.g. 'metric:nesting'."""
+    return 'metric:' + metric
+
+
+class Span:
+    """Running measurement of one stage, returned by Profiler.stage.
+    Set `sentences` and `entities` before the block ends to record the throughput.
+    """
+
+    __slots__ = ('profiler', 'name', 'sentences', 'entities', 'start')
+
+    def __init__(self, profiler, name, sentences=0, entities=0):
+        self.profiler = profiler
+        self.name = name
+        self.sentences = sentences
+        self.entities = entities
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.name, self.start, perf_counter(), self.sentences, self.entities)
+        return False
+
+
+class Profiler:
+    """Record wall time, calls and throughput of every stage of the pipeline.
+    Args:
+        trace (bool): keep every span to export them as trace events.
+        max_events (int): maximum number of trace events kept, later spans only update the totals.
+        callbacks (list): functions called as callback(stage, seconds, sentences, entities) after each span.
+    """
+
+    def __init__(self, trace=True, max_events=1000000, callbacks=None):
+        self.trace = trace
+        self.max_events = max_events
+        self.callbacks = list(callbacks or [])
+        self.stages = {}
+        self.events = []
+        self.dropped_events = 0
+        self.origin = perf_counter()
+
+    def __enter__(self):
+        return self.enable()
+
+    def __exit__(self, *exc_info):
+        self.disable()
+        return False
+
+    def enable(self):
+        """Make this profiler the active one until disable is called."""
+        global active
+        _stack.append(self)
+        active = self
+        return self
+
+    def disable(self):
+        global active
+        if self in _stack:
+            _stack.remove(self)
+        active = _stack[-1] if _stack else None
+
+    def add_callback(self, callback):
+        """Register a function called as callback(stage, seconds, sentences, entities) after each span."""
+        self.callbacks.append(callback)
+
+    def record(self, stage, start, end, sentences=0, entities=0):
+        """Add a span measured with time.perf_counter to the totals of a stage."""
+        seconds = end - start
+        totals = self.stages.get(stage)
+        if totals is None:
+            totals = self.stages[stage] = [0, 0.0, 0, 0]
+        totals[0] += 1
+        totals[1] += seconds
+        totals[2] += sentences
+        totals[3] += entities
+        if self.trace:
+            if len(self.events) < self.max_events:
+                self.events.append((stage, start, seconds, sentences, entities, threading.get_ident()))
+            else:
+                self.dropped_events += 1
+        for callback in self.callbacks:
+            callback(stage, seconds, sentences, entities)
+
+    def stage(self, name, sentences=0, entities=0):
+        """Context manager measuring one span of a stage.
+        Example:
+            >>> with profiler.stage('decoding', sentences=1) as span:
+            ...     entities = get_entities(tags)
+            ...     span.entities = len(entities)
+        """
+        return Span(self, name, sentences, entities)
+
+    def iterate(self, stage, iterable, entities=None):
+        """Yield the items of iterable, timing each step of the iteration as one sentence of a stage.
+        Args:
+            stage (string): stage name.
+            iterable (iterable): iterable of sentences.
+            entities (function): optional function returning the number of entities of an item.
+        """
+        iterator = iter(iterable)
+        try:
+            while True:
+                start = perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                self.record(stage, start, perf_counter(), 1, entities(item) if entities else 0)
+                yield item
+        finally:
+            # Close the wrapped generator (and its file) when the consumer stops early.
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    def summary(self):
+        """Totals of every stage.
+        Returns:
+            dict: stage -> {'calls', 'seconds', 'sentences', 'entities', 'sentences_per_second',
+            'entities_per_second'}, in the order the stages were first seen.
+        """
+        summary = {}
+        for stage, (calls, seconds, sentences, entities) in self.stages.items():
+            summary[stage] = {
+                'calls': calls,
+                'seconds': seconds,
+                'sentences': sentences,
+                'entities': entities,
+                'sentences_per_second': sentences/seconds if seconds else None,
+                'entities_per_second': entities/seconds if seconds else None,
+            }
+        return summary
+
+    def trace_events(self):
+        """Recorded spans as complete ('X') events of the Chrome trace event format, in microseconds."""
+        pid = os.getpid()
+        return [{'name': stage, 'cat': 'nestednereval', 'ph': 'X', 'ts': (start - self.origin) * 1e6,
+                 'dur': seconds * 1e6, 'pid': pid, 'tid': tid, 'args': {'sentences': sentences, 'entities': entities}}
+                for stage, start, seconds, sentences, entities, tid in self.events]
+
+    def write_trace(self, filepath):
+        """Write the trace events and the summary as a JSON trace file."""
+        with open(filepath, 'w', encoding='UTF-8') as trace_file:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms',
+                       'otherData': {'summary': self.summary(), 'dropped_events': self.dropped_events}}, trace_file)
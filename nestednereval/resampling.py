@@ -0,0 +1,220 @@
+"""Bootstrap confidence intervals and paired significance tests.
+The tp/fp/fn/support counts of every sentence are computed once for all the metrics, and each
+resample is then a weighted sum of those per sentence vectors, computed for a batch of resamples
+at once with a matrix product. Sentences with identical count vectors are grouped, so a resample
+only has to draw how many times each distinct vector is picked.
+"""
+from multiprocessing import Pool
+
+import numpy as np
+
+from nestednereval.evaluator import METRICS, Evaluator
+
+SCORES = ('precision', 'recall', 'f1')
+
+
+def sentence_counts(entities, metrics=None):
+    """Confusion counts of every sentence.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        metrics (iterable): metrics to count, by default all of METRICS.
+    Returns:
+        numpy.ndarray: int64 array of shape (n_sentences, n_metrics, 4) with tp, fp, fn and support.
+    """
+    evaluator = Evaluator(metrics)
+    rows = []
+    for sent in entities:
+        counts = evaluator.count(sent["real"], sent["pred"])
+        rows.append([counts[metric] for metric in evaluator.metrics])
+    return np.array(rows, dtype=np.int64).reshape(len(rows), len(evaluator.metrics), 4)
+
+
+def scores(totals):
+    """Vectorized calculate_f1_score.
+    Args:
+        totals (numpy.ndarray): array of shape (..., 4) with tp, fp, fn and support.
+    Returns:
+        numpy.ndarray: array of shape (..., 3) with precision, recall and f1.
+    """
+    totals = np.asarray(totals, dtype=np.float64)
+    tp, fp, fn = totals[..., 0], totals[..., 1], totals[..., 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp+fp != 0, tp/(tp+fp), 0.0)
+        recall = np.where(tp+fn != 0, tp/(tp+fn), 0.0)
+        f1 = np.where(precision+recall != 0, 2*precision*recall/(precision+recall), 0.0)
+    return np.stack([precision, recall, f1], axis=-1)
+
+
+def _batches(n_resamples, batch_size):
+    for start in range(0, n_resamples, batch_size):
+        yield min(batch_size, n_resamples - start)
+
+
+def _compress(rows):
+    """Unique rows and their frequencies, when they are few enough to be worth it.
+    Resampling n sentences then amounts to drawing how many times each distinct count vector is
+    drawn, which costs O(n_unique) instead of O(n) per resample and gives the same distribution.
+    """
+    unique, frequencies = np.unique(rows, axis=0, return_counts=True)
+    if 4*len(unique) <= len(rows):
+        return unique.astype(np.float64), frequencies
+    return rows.astype(np.float64), None
+
+
+def _bootstrap_task(task):
+    seed, n_resamples, batch_size, rows, frequencies, n_sentences = task
+    rng = np.random.default_rng(seed)
+    # Keep the (batch, rows) weight matrix around 2**24 entries by default.
+    batch_size = batch_size or max(1, 2**24 // len(rows))
+    totals = []
+    for batch in _batches(n_resamples, batch_size):
+        if frequencies is None:
+            # Row b counts how many times each sentence is drawn in resample b.
+            draws = rng.integers(0, n_sentences, size=(batch, n_sentences))
+            draws += (np.arange(batch) * n_sentences)[:, None]
+            weights = np.bincount(draws.ravel(), minlength=batch*n_sentences).reshape(batch, n_sentences)
+        else:
+            weights = rng.multinomial(n_sentences, frequencies / n_sentences, size=batch)
+        totals.append(weights @ rows)
+    return np.concatenate(totals)
+
+
+def _randomization_task(task):
+    seed, n_resamples, batch_size, rows, frequencies, n_sentences = task
+    rng = np.random.default_rng(seed)
+    batch_size = batch_size or max(1, 2**24 // len(rows))
+    moved = []
+    for batch in _batches(n_resamples, batch_size):
+        if frequencies is None:
+            swaps = rng.integers(0, 2, size=(batch, len(rows)))
+        else:
+            swaps = rng.binomial(frequencies, 0.5, size=(batch, len(rows)))
+        moved.append(swaps @ rows)
+    return np.concatenate(moved)
+
+
+def _run(task_function, rows, n_resamples, seed, workers, batch_size):
+    """Split the resamples over the workers, each with an independent random stream.
+    Returns:
+        numpy.ndarray: (n_resamples, n_columns) weighted sums of the rows.
+    """
+    workers = workers or 1
+    n_sentences = len(rows)
+    rows, frequencies = _compress(rows)
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+    sizes = [n_resamples // workers + (1 if i < n_resamples % workers else 0) for i in range(workers)]
+    tasks = [(seed, size, batch_size, rows, frequencies, n_sentences) for seed, size in zip(seeds, sizes) if size]
+    if workers == 1:
+        parts = [task_function(task) for task in tasks]
+    else:
+        with Pool(processes=workers) as pool:
+            parts = pool.map(task_function, tasks)
+    return np.concatenate(parts)
+
+
+def _interval(point, samples, confidence, metrics):
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(samples, [alpha, 1 - alpha], axis=0)
+    std = samples.std(axis=0)
+    return {metric: {score: {'value': float(point[m, s]), 'low': float(low[m, s]), 'high': float(high[m, s]),
+                             'std': float(std[m, s])}
+                     for s, score in enumerate(SCORES)}
+            for m, metric in enumerate(metrics)}
+
+
+def bootstrap(counts, metrics=None, n_resamples=10000, confidence=0.95, seed=None, workers=1, batch_size=None):
+    """Percentile bootstrap confidence intervals of the precision, recall and f1 of every metric.
+    Args:
+        counts (numpy.ndarray): per sentence counts returned by sentence_counts.
+        metrics (iterable): metrics of the second axis of counts, by default all of METRICS.
+        n_resamples (int): number of bootstrap resamples.
+        confidence (float): confidence level of the intervals.
+        seed (int): random seed, results are reproducible for a given seed and number of workers.
+        workers (int): number of processes the resamples are split over.
+        batch_size (int): resamples computed at once, by default about 2**24 / n_distinct_sentences.
+    Returns:
+        dict: metric -> score -> {'value', 'low', 'high', 'std'}.
+    Example:
+        >>> counts = sentence_counts(entities)
+        >>> bootstrap(counts, seed=0)['standard']['f1']
+    """
+    metrics = METRICS if metrics is None else tuple(metrics)
+    counts = np.asarray(counts)
+    if len(counts) == 0:
+        raise ValueError('Cannot resample an empty set of sentences')
+    totals = _run(_bootstrap_task, counts.reshape(len(counts), -1), n_resamples, seed, workers, batch_size)
+    samples = scores(totals.reshape((n_resamples,) + counts.shape[1:]))
+    return _interval(scores(counts.sum(axis=0)), samples, confidence, metrics)
+
+
+def _check_paired(counts_a, counts_b):
+    counts_a = np.asarray(counts_a)
+    counts_b = np.asarray(counts_b)
+    if counts_a.shape != counts_b.shape:
+        raise ValueError('Paired tests need counts over the same sentences, got shapes {} and {}'.format(
+            counts_a.shape, counts_b.shape))
+    if len(counts_a) == 0:
+        raise ValueError('Cannot resample an empty set of sentences')
+    return counts_a, counts_b
+
+
+def _test_result(observed, samples, p_values, confidence, metrics):
+    result = _interval(observed, samples, confidence, metrics)
+    for m, metric in enumerate(metrics):
+        for s, score in enumerate(SCORES):
+            result[metric][score]['p_value'] = float(p_values[m, s])
+    return result
+
+
+def paired_bootstrap(counts_a, counts_b, metrics=None, n_resamples=10000, confidence=0.95, seed=None, workers=1,
+                     batch_size=None):
+    """Paired bootstrap test of the difference between two systems evaluated on the same sentences.
+    Both systems are scored on the same resamples. The p-value is the fraction of resamples where the
+    difference does not have the sign of the observed difference (one-sided test that the better
+    system is not actually better).
+    Args:
+        counts_a (numpy.ndarray): per sentence counts of system A returned by sentence_counts.
+        counts_b (numpy.ndarray): per sentence counts of system B, same sentences and metrics.
+        metrics, n_resamples, confidence, seed, workers, batch_size: see bootstrap.
+    Returns:
+        dict: metric -> score -> {'value', 'low', 'high', 'std', 'p_value'} of the difference A - B.
+    """
+    metrics = METRICS if metrics is None else tuple(metrics)
+    counts_a, counts_b = _check_paired(counts_a, counts_b)
+    rows = np.concatenate([counts_a.reshape(len(counts_a), -1), counts_b.reshape(len(counts_b), -1)], axis=1)
+    totals_a, totals_b = np.split(_run(_bootstrap_task, rows, n_resamples, seed, workers, batch_size), 2, axis=1)
+    samples_a = scores(totals_a.reshape((n_resamples,) + counts_a.shape[1:]))
+    samples_b = scores(totals_b.reshape((n_resamples,) + counts_b.shape[1:]))
+    observed = scores(counts_a.sum(axis=0)) - scores(counts_b.sum(axis=0))
+    samples = samples_a - samples_b
+    p_values = np.where(observed > 0, (samples <= 0).mean(axis=0),
+                        np.where(observed < 0, (samples >= 0).mean(axis=0), 1.0))
+    return _test_result(observed, samples, p_values, confidence, metrics)
+
+
+def approximate_randomization(counts_a, counts_b, metrics=None, n_resamples=10000, seed=None, workers=1,
+                              batch_size=None):
+    """Approximate randomization test of the difference between two systems on the same sentences.
+    In every resample the outputs of both systems are swapped on a random half of the sentences.
+    Args:
+        counts_a (numpy.ndarray): per sentence counts of system A returned by sentence_counts.
+        counts_b (numpy.ndarray): per sentence counts of system B, same sentences and metrics.
+        metrics, n_resamples, seed, workers, batch_size: see bootstrap.
+    Returns:
+        dict: metric -> score -> {'value', 'p_value'}, where value is the observed difference A - B and
+        p_value the two-sided (r + 1) / (n_resamples + 1) estimate.
+    """
+    metrics = METRICS if metrics is None else tuple(metrics)
+    counts_a, counts_b = _check_paired(counts_a, counts_b)
+    difference = (counts_b - counts_a).reshape(len(counts_a), -1)
+    moved = _run(_randomization_task, difference, n_resamples, seed, workers, batch_size)
+    moved = moved.reshape((n_resamples,) + counts_a.shape[1:])
+    total_a = counts_a.sum(axis=0)
+    total_b = counts_b.sum(axis=0)
+    deltas = scores(total_a + moved) - scores(total_b - moved)
+    observed = scores(counts_a.sum(axis=0)) - scores(counts_b.sum(axis=0))
+    extreme = (np.abs(deltas) >= np.abs(observed) - 1e-12).sum(axis=0)
+    p_values = (extreme + 1) / (n_resamples + 1)
+    return {metric: {score: {'value': float(observed[m, s]), 'p_value': float(p_values[m, s])}
+                     for s, score in enumerate(SCORES)}
+            for m, metric in enumerate(metrics)}
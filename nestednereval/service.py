@@ -0,0 +1,315 @@
+"""Asyncio evaluation service shared by many concurrent jobs.
+Clients submit batches of sentences tagged with a run id. The batches waiting in the queue are
+coalesced into one larger batch (up to max_batch sentences or max_delay seconds), counted by the
+metric engine in an executor so the event loop stays responsive, and added to the
+MetricAccumulator of their run. The service can be used in process (EvaluationService) or over a
+small HTTP/1.1 JSON interface on a TCP port or a Unix socket (serve).
+
+Routes:
+    POST /runs/<run>/sentences   body: {"sentences": [{"real": [[type, start, end], ...], "pred": [...]}, ...]}
+    GET /runs/<run>/metrics      current scores of a run
+    DELETE /runs/<run>           forget a run
+    GET /runs                    run ids and number of sentences
+
+Usage:
+    python -m nestednereval.service --port 8642
+    curl -X POST localhost:8642/runs/dev/sentences -d '{"sentences": [{"real": [["PER", 0, 1]], "pred": [["PER", 0, 1]]}]}'
+    curl localhost:8642/runs/dev/metrics
+"""
+import argparse
+import asyncio
+import json
+import sys
+from urllib.parse import unquote
+
+from nestednereval.evaluator import EvaluationResult, Evaluator, MetricAccumulator
+
+
+def _is_offset(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _as_entities(entities):
+    if not isinstance(entities, list):
+        raise ValueError('Entities must be a list, got {!r}'.format(entities))
+    converted = []
+    for entity in entities:
+        if (not isinstance(entity, list) or len(entity) != 3 or not isinstance(entity[0], str)
+                or not _is_offset(entity[1]) or not _is_offset(entity[2])):
+            raise ValueError('Entities must be [type, start, end] with a string type and integer offsets, got {!r}'.format(entity))
+        converted.append(tuple(entity))
+    return converted
+
+
+def _as_sentences(sentences):
+    """Sentences received as JSON (lists instead of tuples) as dicts of entity tuples."""
+    if not isinstance(sentences, list):
+        raise ValueError('sentences must be a list')
+    converted = []
+    for sent in sentences:
+        if not isinstance(sent, dict) or "real" not in sent or "pred" not in sent:
+            raise ValueError('Every sentence must be an object with "real" and "pred" entities')
+        converted.append({"real": _as_entities(sent["real"]), "pred": _as_entities(sent["pred"])})
+    return converted
+
+
+def _evaluate_runs(metrics, runs):
+    """Counts of the sentences of every run of a coalesced batch (run in the executor)."""
+    evaluator = Evaluator(metrics)
+    return {run: evaluator.evaluate(sentences) for run, sentences in runs.items()}
+
+
+class EvaluationService:
+    """In-process async evaluation service with per-run accumulators.
+    Args:
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        max_batch (int): sentences coalesced into one batch of the metric engine.
+        max_delay (float): seconds a batch waits for more sentences before it is evaluated.
+        executor (concurrent.futures.Executor): executor of the metric engine, the loop's default
+            thread pool by default. A ProcessPoolExecutor evaluates batches on other cores.
+    Example:
+        >>> async with EvaluationService() as service:
+        ...     await service.submit('dev', entities)
+        ...     result = await service.result('dev')
+        >>> result['nesting']
+        (1.0, 0.5, 0.6666666666666666, 2)
+    """
+
+    def __init__(self, metrics=None, max_batch=1024, max_delay=0.005, executor=None):
+        self.metrics = Evaluator(metrics).metrics
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.executor = executor
+        self.runs = {}
+        self._queue = None
+        self._worker = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+        return False
+
+    def start(self):
+        """Start the batching task on the running event loop."""
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.ensure_future(self._batches())
+
+    async def stop(self):
+        """Evaluate the queued batches and stop the batching task."""
+        if self._worker is not None:
+            await self._queue.join()
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def submit(self, run, sentences):
+        """Add sentences to a run and wait until they are counted.
+        Args:
+            run (string): run id, its accumulator is created on first use.
+            sentences (list(dict)): Sentences (dicts) containing predicted and original entities.
+        Returns:
+            int: number of sentences of the run.
+        """
+        if self._worker is None:
+            raise RuntimeError('The service is not started')
+        sentences = list(sentences)
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((run, sentences, done))
+        return await done
+
+    async def result(self, run):
+        """EvaluationResult of all the sentences submitted to a run (an empty result for unknown runs)."""
+        accumulator = self.runs.get(run)
+        return accumulator.compute() if accumulator else EvaluationResult(self.metrics)
+
+    def sentences(self, run):
+        """Number of sentences counted in a run."""
+        accumulator = self.runs.get(run)
+        return accumulator.n_sentences if accumulator else 0
+
+    def reset(self, run):
+        """Forget a run. Returns whether it existed."""
+        return self.runs.pop(run, None) is not None
+
+    async def _next_batch(self):
+        items = [await self._queue.get()]
+        size = len(items[0][1])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while size < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            items.append(item)
+            size += len(item[1])
+        return items
+
+    def _accumulator(self, run):
+        accumulator = self.runs.get(run)
+        if accumulator is None:
+            accumulator = self.runs[run] = MetricAccumulator(self.metrics)
+        return accumulator
+
+    async def _process(self, items):
+        runs = {}
+        for run, sentences, _ in items:
+            runs.setdefault(run, []).extend(sentences)
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self.executor, _evaluate_runs, self.metrics, runs)
+        except Exception as error:
+            if len(items) == 1:
+                if not items[0][2].done():
+                    items[0][2].set_exception(error)
+                return
+            # A malformed submission fails the whole coalesced batch, so evaluate them one by one.
+            for item in items:
+                await self._process([item])
+            return
+        for run, result in results.items():
+            accumulator = self._accumulator(run)
+            accumulator.merge(result)
+            accumulator.n_sentences += len(runs[run])
+        for run, _, done in items:
+            if not done.done():
+                done.set_result(self.sentences(run))
+
+    async def _batches(self):
+        while True:
+            items = await self._next_batch()
+            try:
+                await self._process(items)
+            finally:
+                for _ in items:
+                    self._queue.task_done()
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+async def _respond(writer, status, body, keep_alive):
+    data = json.dumps(body).encode('UTF-8')
+    writer.write('HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+        status, _REASONS[status], len(data), 'keep-alive' if keep_alive else 'close').encode('latin-1') + data)
+    await writer.drain()
+
+
+async def _route(service, method, path, body):
+    """Status and JSON body of one request."""
+    parts = [unquote(part) for part in path.split('?')[0].strip('/').split('/')]
+    if parts == ['runs']:
+        if method != 'GET':
+            return 405, {'error': 'use GET'}
+        return 200, {'runs': {run: service.sentences(run) for run in service.runs}}
+    if len(parts) == 3 and parts[0] == 'runs' and parts[2] == 'sentences':
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        try:
+            payload = json.loads(body.decode('UTF-8') or 'null')
+            sentences = _as_sentences(payload.get('sentences') if isinstance(payload, dict) else payload)
+        except (ValueError, TypeError) as error:
+            return 400, {'error': str(error)}
+        return 200, {'run': parts[1], 'sentences': await service.submit(parts[1], sentences)}
+    if len(parts) == 3 and parts[0] == 'runs' and parts[2] == 'metrics':
+        if method != 'GET':
+            return 405, {'error': 'use GET'}
+        result = await service.result(parts[1])
+        return 200, {'run': parts[1], 'sentences': service.sentences(parts[1]), 'metrics': result.to_dict()}
+    if len(parts) == 2 and parts[0] == 'runs':
+        if method != 'DELETE':
+            return 405, {'error': 'use DELETE'}
+        return (200, {'run': parts[1], 'deleted': True}) if service.reset(parts[1]) else (404, {'error': 'unknown run'})
+    return 404, {'error': 'not found'}
+
+
+async def _handle(service, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            try:
+                method, path, version = request_line.decode('latin-1').split()
+            except ValueError:
+                await _respond(writer, 400, {'error': 'malformed request line'}, False)
+                break
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            try:
+                length = int(headers.get('content-length', 0))
+                if length < 0:
+                    raise ValueError
+            except ValueError:
+                # Without a valid length the body cannot be skipped, so the connection is closed.
+                await _respond(writer, 400, {'error': 'invalid Content-Length'}, False)
+                break
+            body = await reader.readexactly(length)
+            keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+            try:
+                status, response = await _route(service, method.upper(), path, body)
+            except Exception as error:
+                status, response = 500, {'error': '{}: {}'.format(type(error).__name__, error)}
+            await _respond(writer, status, response, keep_alive)
+            if not keep_alive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8642, path=None):
+    """Serve an EvaluationService over HTTP, on a TCP port or on the Unix socket at path.
+    Returns:
+        asyncio.AbstractServer: the started server, close it with server.close().
+    """
+    service.start()
+
+    def handler(reader, writer):
+        return _handle(service, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path=path)
+    return await asyncio.start_server(handler, host=host, port=port)
+
+
+async def _serve_forever(args):
+    async with EvaluationService(args.metrics, args.max_batch, args.max_delay) as service:
+        server = await serve(service, args.host, args.port, args.unix)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8642)
+    parser.add_argument('--unix', metavar='PATH', help='listen on a Unix socket instead of a TCP port')
+    parser.add_argument('--metrics', nargs='+', help='metrics to compute (all by default)')
+    parser.add_argument('--max-batch', type=int, default=1024, help='sentences coalesced into one batch')
+    parser.add_argument('--max-delay', type=float, default=0.005, help='seconds a batch waits for more sentences')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
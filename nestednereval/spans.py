@@ -0,0 +1,238 @@
+"""Compact representation of entities and nestings for very large corpora.
+Entity types are interned in a TypeVocabulary and every entity is packed into one 64-bit
+integer, (start << 39) | (end << 15) | type_id, stored in an `array` per sentence side: 8 bytes
+per entity instead of a tuple of three objects. Nestings are stored in compressed sparse row
+form, the indices of the members of every nesting into the span array of the sentence.
+
+Packed entities compare equal exactly when the (type, start, end) tuples do, so the Evaluator
+(and every function built on it: evaluate_all, MetricAccumulator, parallel_evaluate and the
+standard, flat, inner, outer, nested and nesting metrics) works on them natively and gives the
+same counts as on tuples. get_nestings and the length and nesting level metrics of
+nestednereval.metrics unpack the spans of one sentence at a time with utils.entity_tuples, the
+other tools take the tuples returned by CompactSentence.to_dict.
+
+Example:
+    >>> corpus = compact_corpus(entities)
+    >>> evaluate_all(corpus)['nesting']
+    (1.0, 0.5, 0.6666666666666666, 2)
+"""
+from array import array
+from bisect import bisect_left, bisect_right
+
+START_SHIFT = 39
+END_SHIFT = 15
+OFFSET_MASK = (1 << 24) - 1
+TYPE_MASK = (1 << 15) - 1
+
+
+class TypeVocabulary:
+    """Interned entity types.
+    Args:
+        types (iterable): initial types, their ids follow the given order.
+    """
+
+    __slots__ = ('types', 'type_ids')
+
+    def __init__(self, types=()):
+        self.types = []
+        self.type_ids = {}
+        for type_ in types:
+            self.intern(type_)
+
+    def intern(self, type_):
+        """Id of a type, added to the vocabulary if it is new."""
+        type_id = self.type_ids.get(type_)
+        if type_id is None:
+            type_id = len(self.types)
+            if type_id > TYPE_MASK:
+                raise ValueError('A vocabulary holds at most {} types'.format(TYPE_MASK + 1))
+            self.type_ids[type_] = type_id
+            self.types.append(type_)
+        return type_id
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getstate__(self):
+        return self.types
+
+    def __setstate__(self, types):
+        self.types = list(types)
+        self.type_ids = {type_: type_id for type_id, type_ in enumerate(self.types)}
+
+
+def pack_span(type_id, start, end):
+    """Pack an entity into one integer. start and end must be between 0 and 2**24 - 1."""
+    if not (0 <= start <= OFFSET_MASK and 0 <= end <= OFFSET_MASK):
+        raise ValueError('Span offsets must be between 0 and {}, got ({}, {})'.format(OFFSET_MASK, start, end))
+    return (start << START_SHIFT) | (end << END_SHIFT) | type_id
+
+
+def unpack_span(packed):
+    """(type_id, start, end) of a packed entity."""
+    return packed & TYPE_MASK, packed >> START_SHIFT, (packed >> END_SHIFT) & OFFSET_MASK
+
+
+class SpanArray(array):
+    """Packed entities of one side of a sentence, with the vocabulary of their types.
+    Args:
+        vocabulary (TypeVocabulary): vocabulary of the type ids.
+        values (iterable): packed entities.
+    """
+
+    __slots__ = ('vocabulary',)
+
+    def __new__(cls, vocabulary, values=()):
+        spans = super().__new__(cls, 'q', values)
+        spans.vocabulary = vocabulary
+        return spans
+
+    def __reduce_ex__(self, protocol):
+        return _span_array, (self.vocabulary, self.tobytes())
+
+    @classmethod
+    def from_entities(cls, entities, vocabulary):
+        """Pack a list of (chunk_type, chunk_start, chunk_end)."""
+        intern = vocabulary.intern
+        return cls(vocabulary, [pack_span(intern(type_), start, end) for type_, start, end in entities])
+
+    def entities(self):
+        """The entities as a list of (chunk_type, chunk_start, chunk_end)."""
+        types = self.vocabulary.types
+        return [(types[packed & TYPE_MASK], packed >> START_SHIFT, (packed >> END_SHIFT) & OFFSET_MASK) for packed in self]
+
+    def nestings(self):
+        """Nestings of the sentence, the same as get_nestings on the entities.
+        Returns:
+            CompactNestings: members of every nesting as indices into this array.
+        """
+        return packed_nestings(self)
+
+
+def _span_array(vocabulary, data):
+    spans = SpanArray(vocabulary)
+    spans.frombytes(data)
+    return spans
+
+
+class CompactNestings:
+    """Nestings of a sentence in compressed sparse row form.
+    The members of nesting i are spans[members[offsets[i]:offsets[i+1]]], outermost entity first,
+    so members[offsets[i]] is the index of the outer entity and the next ones of the inner entities.
+    Iterating (or indexing) gives every nesting as a list of packed entities, as get_nestings does
+    with tuples.
+    """
+
+    __slots__ = ('spans', 'offsets', 'members')
+
+    def __init__(self, spans, offsets, members):
+        self.spans = spans
+        self.offsets = offsets
+        self.members = members
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        spans = self.spans
+        return [spans[j] for j in self.members[self.offsets[i]:self.offsets[i+1]]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def outer_index(self, i):
+        """Index in the span array of the outer entity of nesting i."""
+        return self.members[self.offsets[i]]
+
+    def inner_range(self, i):
+        """Range of members positions of the inner entities of nesting i."""
+        return range(self.offsets[i] + 1, self.offsets[i+1])
+
+
+def packed_nestings(spans):
+    """Nestings of a SpanArray, with the sort-and-sweep algorithm of get_nestings.
+    Args:
+        spans (SpanArray): packed entities of one sentence.
+    Returns:
+        CompactNestings: nestings in the order and with the member order of get_nestings.
+    """
+    types = spans.vocabulary.types
+    decoded = [(packed >> START_SHIFT, (packed >> END_SHIFT) & OFFSET_MASK) for packed in spans]
+
+    outer_starts = []
+    outer_ends = []
+    for start, end in sorted(set(decoded), key=lambda span: (span[0], -span[1])):
+        if not outer_ends or end > outer_ends[-1]:
+            outer_starts.append(start)
+            outer_ends.append(end)
+    outer_index = {span: i for i, span in enumerate(zip(outer_starts, outer_ends))}
+
+    members = [[] for _ in outer_starts]
+    for i, (start, end) in enumerate(decoded):
+        lo = bisect_left(outer_ends, end)
+        hi = bisect_right(outer_starts, start)
+        for k in range(lo, hi):
+            members[k].append(i)
+
+    def order(i):
+        start, end = decoded[i]
+        return end - start, types[spans[i] & TYPE_MASK]
+
+    offsets = array('i', [0])
+    nesting_members = array('i')
+    seen = set()
+    for i, span in enumerate(decoded):
+        k = outer_index.get(span)
+        if k is None:
+            continue
+        group = [i]
+        group.extend(j for j in members[k] if spans[j] != spans[i])
+        if len(group) == 1:
+            continue
+        group.sort(key=order, reverse=True)
+        key = tuple(spans[j] for j in group)
+        if key not in seen:
+            seen.add(key)
+            nesting_members.extend(group)
+            offsets.append(len(nesting_members))
+    return CompactNestings(spans, offsets, nesting_members)
+
+
+class CompactSentence:
+    """Real and predicted packed entities of one sentence, indexable as sent["real"] and sent["pred"]."""
+
+    __slots__ = ('real', 'pred')
+
+    def __init__(self, real, pred):
+        self.real = real
+        self.pred = pred
+
+    def __getitem__(self, side):
+        if side == "real":
+            return self.real
+        if side == "pred":
+            return self.pred
+        raise KeyError(side)
+
+    def to_dict(self):
+        """The sentence as a dict of (chunk_type, chunk_start, chunk_end) lists."""
+        return {"real": self.real.entities(), "pred": self.pred.entities()}
+
+
+def iter_compact(entities, vocabulary=None):
+    """Yield every sentence as a CompactSentence sharing one vocabulary.
+    Args:
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+        vocabulary (TypeVocabulary): vocabulary to intern the types in, a new one by default.
+    """
+    vocabulary = TypeVocabulary() if vocabulary is None else vocabulary
+    for sent in entities:
+        yield CompactSentence(SpanArray.from_entities(sent["real"], vocabulary),
+                              SpanArray.from_entities(sent["pred"], vocabulary))
+
+
+def compact_corpus(entities, vocabulary=None):
+    """List of the sentences as CompactSentence, see iter_compact."""
+    return list(iter_compact(entities, vocabulary))
+
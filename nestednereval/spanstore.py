@@ -0,0 +1,213 @@
+"""Compact columnar on-disk format for the entities of a corpus, loaded with numpy.memmap.
+A span store file holds, for the real and the predicted side, the span offsets of every sentence
+and int32 arrays with the type id, start and end of every span, plus the type vocabulary.
+Opening a store only reads its small JSON header, the arrays are memory mapped so several worker
+processes share the same pages, and all the metrics run on them without building tuples.
+
+Layout: MAGIC, header length (uint64, little endian), JSON header padded to 8 bytes, arrays.
+"""
+import json
+import os
+import struct
+from array import array
+
+import numpy as np
+
+from nestednereval.evaluator import METRICS, EvaluationResult, Evaluator
+from nestednereval.vectorized import SpanColumns, evaluate_columns
+from nestednereval.utils import iter_iob2_prediction_file, iter_merged_iob2_files
+
+MAGIC = b'NNSPAN\x01\x00'
+
+SIDES = ("real", "pred")
+
+# offsets are int64 so a side can hold more than 2**31 spans.
+FIELDS = (('offsets', '<i8'), ('type_ids', '<i4'), ('starts', '<i4'), ('ends', '<i4'))
+
+
+def write_span_store(filepath, entities):
+    """Write the entities of a corpus as a span store.
+    Args:
+        filepath (string): output filepath.
+        entities (iterable(dict)): Sentences (dicts) containing predicted and original entities.
+    Returns:
+        int: number of sentences written.
+    """
+    type_index = {}
+    columns = {side: {'offsets': array('q', [0]), 'type_ids': array('i'), 'starts': array('i'), 'ends': array('i')}
+               for side in SIDES}
+    n_sentences = 0
+    for sent in entities:
+        n_sentences += 1
+        for side in SIDES:
+            side_columns = columns[side]
+            for type_, start, end in sent[side]:
+                type_id = type_index.get(type_)
+                if type_id is None:
+                    type_id = type_index[type_] = len(type_index)
+                side_columns['type_ids'].append(type_id)
+                side_columns['starts'].append(start)
+                side_columns['ends'].append(end)
+            side_columns['offsets'].append(len(side_columns['type_ids']))
+
+    # Type ids follow the order of the type names, as in nestednereval.vectorized.
+    types = sorted(type_index)
+    remap = np.zeros(len(types), dtype=np.int32)
+    for new_id, type_ in enumerate(types):
+        remap[type_index[type_]] = new_id
+
+    arrays = []
+    layout = {}
+    position = 0
+    for side in SIDES:
+        for field, dtype in FIELDS:
+            values = np.frombuffer(columns[side][field], dtype=np.int64 if field == 'offsets' else np.int32)
+            if field == 'type_ids' and len(values):
+                values = remap[values]
+            values = values.astype(dtype)
+            layout['{}.{}'.format(side, field)] = [position, dtype, len(values)]
+            arrays.append(values)
+            position += values.nbytes + (-values.nbytes) % 8
+
+    header = json.dumps({'format': 1, 'n_sentences': n_sentences, 'types': types, 'arrays': layout}).encode('UTF-8')
+    header += b' ' * ((-len(header)) % 8)
+    with open(filepath, 'wb') as store:
+        store.write(MAGIC)
+        store.write(struct.pack('<Q', len(header)))
+        store.write(header)
+        for values in arrays:
+            store.write(values.tobytes())
+            store.write(b'\0' * ((-values.nbytes) % 8))
+    return n_sentences
+
+
+def write_span_store_from_iob2(filepath, iob2_filepaths, suffix=False, dedupe_real=False):
+    """Decode IOB2 files and write their entities as a span store.
+    Args:
+        filepath (string): output filepath.
+        iob2_filepaths (string or list): an IOB2 file, or the IOB2 files predicted per entity type.
+        suffix (bool): tags have the prefix at the end, see get_entities.
+        dedupe_real (bool): see iter_merged_iob2_files.
+    Returns:
+        int: number of sentences written.
+    """
+    if isinstance(iob2_filepaths, (str, bytes, os.PathLike)):
+        sentences = iter_iob2_prediction_file(iob2_filepaths, suffix=suffix)
+    else:
+        sentences = iter_merged_iob2_files(iob2_filepaths, dedupe_real=dedupe_real, suffix=suffix)
+    return write_span_store(filepath, sentences)
+
+
+class SpanSide:
+    """Memory mapped spans of one side (real or pred) of a span store."""
+
+    def __init__(self, offsets, type_ids, starts, ends):
+        self.offsets = offsets
+        self.type_ids = type_ids
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.type_ids)
+
+
+class SpanStore:
+    """Span store opened with memory mapped arrays.
+    Args:
+        filepath (string): filepath of a file written by write_span_store.
+    Example:
+        >>> store = SpanStore('test.spans')
+        >>> store.evaluate()['nested']
+    """
+
+    def __init__(self, filepath):
+        self.filepath = filepath
+        with open(filepath, 'rb') as store:
+            if store.read(len(MAGIC)) != MAGIC:
+                raise ValueError('{} is not a span store'.format(filepath))
+            header_length, = struct.unpack('<Q', store.read(8))
+            header = json.loads(store.read(header_length).decode('UTF-8'))
+        data_offset = len(MAGIC) + 8 + header_length
+        self.n_sentences = header['n_sentences']
+        self.types = header['types']
+        sides = {}
+        for side in SIDES:
+            fields = {}
+            for field, _ in FIELDS:
+                position, dtype, count = header['arrays']['{}.{}'.format(side, field)]
+                if count:
+                    fields[field] = np.memmap(filepath, dtype=dtype, mode='r', offset=data_offset + position, shape=(count,))
+                else:
+                    fields[field] = np.zeros(0, dtype=dtype)
+            sides[side] = SpanSide(**fields)
+        self.real = sides["real"]
+        self.pred = sides["pred"]
+
+    def __len__(self):
+        return self.n_sentences
+
+    def columns(self, side, start=0, stop=None):
+        """SpanColumns of the sentences [start, stop) of one side, for nestednereval.vectorized."""
+        spans = getattr(self, side)
+        stop = self.n_sentences if stop is None else min(stop, self.n_sentences)
+        lo, hi = int(spans.offsets[start]), int(spans.offsets[stop])
+        sentence_ids = np.repeat(np.arange(start, stop, dtype=np.int64), np.diff(spans.offsets[start:stop + 1]))
+        return SpanColumns(sentence_ids, spans.type_ids[lo:hi], spans.starts[lo:hi], spans.ends[lo:hi])
+
+    def sentences(self, start=0, stop=None):
+        """Yield the sentences [start, stop) as dicts of (type, start, end) tuples."""
+        stop = self.n_sentences if stop is None else min(stop, self.n_sentences)
+        for i in range(start, stop):
+            sent = {}
+            for side in SIDES:
+                spans = getattr(self, side)
+                lo, hi = int(spans.offsets[i]), int(spans.offsets[i + 1])
+                sent[side] = [(self.types[type_id], span_start, span_end) for type_id, span_start, span_end in
+                              zip(spans.type_ids[lo:hi].tolist(), spans.starts[lo:hi].tolist(), spans.ends[lo:hi].tolist())]
+            yield sent
+
+    def __iter__(self):
+        return self.sentences()
+
+    def evaluate(self, metrics=None, start=0, stop=None):
+        """Compute the metrics over the sentences [start, stop).
+        Every metric, the nesting metric included, runs on the memory mapped arrays with
+        nestednereval.vectorized, without building Python tuples.
+        Args:
+            metrics (iterable): metrics to compute, by default all of METRICS.
+        Returns:
+            EvaluationResult: counts and scores of every metric.
+        """
+        metrics = METRICS if metrics is None else tuple(Evaluator(metrics).metrics)
+        return evaluate_columns(self.columns("real", start, stop), self.columns("pred", start, stop), metrics)
+
+
+def _evaluate_shard(task):
+    filepath, metrics, start, stop = task
+    return SpanStore(filepath).evaluate(metrics, start, stop)
+
+
+def evaluate_span_store(filepath, metrics=None, workers=1, chunk_sentences=100000):
+    """Evaluate a span store, optionally over a pool of processes sharing the memory mapped file.
+    Args:
+        filepath (string): filepath of a span store.
+        metrics (iterable): metrics to compute, by default all of METRICS.
+        workers (int): number of processes.
+        chunk_sentences (int): sentences evaluated per task.
+    Returns:
+        EvaluationResult: counts and scores of every metric.
+    """
+    from multiprocessing import Pool
+
+    metrics = METRICS if metrics is None else tuple(Evaluator(metrics).metrics)
+    n_sentences = len(SpanStore(filepath))
+    tasks = [(filepath, metrics, start, start + chunk_sentences) for start in range(0, n_sentences, chunk_sentences)]
+    result = EvaluationResult(metrics)
+    if workers == 1:
+        for task in tasks:
+            result.merge(_evaluate_shard(task))
+        return result
+    with Pool(processes=workers) as pool:
+        for partial in pool.imap_unordered(_evaluate_shard, tasks):
+            result.merge(partial)
+    return result
@@ -1,13 +1,62 @@
 """Useful functions for reading files in IOB2 format 
 and obtaining flat and nested entities.
 """
-import re
+import threading
 import warnings
+from bisect import bisect_left, bisect_right
+from itertools import zip_longest
 
-def read_iob2_prediction_file(filepath):
+from nestednereval import profiling
+
+def iter_iob2_sentences(filepath):
+    """Read files in IOB2 format line by line and yield the tags of each sentence.
+    Sentences are separated by blank lines, only the current sentence is kept in memory.
+    Args:
+        filepath (string): filepath of IOB2 file. (first column token, second column real tag, third column predicted tag)
+    Yields:
+        tuple: (real_tags, pred_tags) lists of one sentence.
+    """
+    if profiling.active is None:
+        return _read_iob2_sentences(filepath)
+    return profiling.active.iterate('reading', _read_iob2_sentences(filepath))
+
+def _read_iob2_sentences(filepath):
+    with open(filepath, 'r', encoding='UTF-8') as iob2_file:
+        real_tags = []
+        pred_tags = []
+        for line in iob2_file:
+            columns = line.split()
+            if not columns:
+                if real_tags:
+                    yield real_tags, pred_tags
+                    real_tags = []
+                    pred_tags = []
+                continue
+            real_tags.append(columns[1])
+            pred_tags.append(columns[2])
+        if real_tags:
+            yield real_tags, pred_tags
+
+def iter_iob2_prediction_file(filepath, suffix=False):
+    """Read files in IOB2 format and yield the original and predicted entities of each sentence.
+    Args:
+        filepath (string): filepath of IOB2 file. (first column token, second column real tag, third column predicted tag)
+        suffix (bool): tags have the prefix at the end (PER-B instead of B-PER), see get_entities.
+    Yields:
+        dict: predicted and original entities of one sentence.
+    Example:
+        >>> for sent in iter_iob2_prediction_file('prediction.iob2'):
+        ...     print(sent)
+        {"real": [(PER, 0, 1)], "pred": [(PER, 0, 1)]}
+    """
+    for real_tags, pred_tags in iter_iob2_sentences(filepath):
+        yield {"real": get_entities(real_tags, suffix), "pred": get_entities(pred_tags, suffix)}
+
+def read_iob2_prediction_file(filepath, suffix=False):
     """Read files in IOB2 format and obtain a list of tags associated with each sentence.
     Args:
         filepath (string): filepath of IOB2 file. (first column token, second column real tag, third column predicted tag)
+        suffix (bool): tags have the prefix at the end (PER-B instead of B-PER), see get_entities.
     Returns:
         list: list of dicts, which contains predicted and original entities.
     Example:
@@ -21,26 +70,14 @@ def read_iob2_prediction_file(filepath):
         >>> read_iob2_file(filepath)
             [{"real": [(PER, 0, 1)], "pred": (PER, 0, 1)]}]
     """
+    return list(iter_iob2_prediction_file(filepath, suffix))
 
-    iob2_file = open(filepath, 'r', encoding='UTF-8').read()
-    iob2_file = re.sub(r'\n\s*\n', '\n\n', iob2_file)
-    chunks = []
-    for i, sent in enumerate(iob2_file.split('\n\n')):
-        real_tags = []
-        pred_tags = []
-        for line in sent.splitlines():
-            real_tag = line.split()[1]
-            pred_tag = line.split()[2]
-            real_tags.append(real_tag)
-            pred_tags.append(pred_tag)
-        
-        chunks.append({"real": get_entities(real_tags), "pred": get_entities(pred_tags)})
-    return chunks
-
-def merge_predictions(entities):
+def merge_predictions(entities, dedupe_real=False):
     """Merge predictions on different entity types into one data structure for retrieving nested entities.
+    The input is not modified, the merged sentences are new dicts and lists.
     Args:
         entities (list of list of dics): List of dicts with original entities and predictions per entity type
+        dedupe_real (bool): keep only the first occurrence of original entities present in several entity types.
     Returns:
         list: list of dicts, which contains predicted and original entities.
     Example:
@@ -48,30 +85,113 @@ def merge_predictions(entities):
         >>> merge_predictions(entities)
             [{"real": [(PER, 0, 1)], "pred": [(PER, 0, 1), (ORG, 0, 1)]}]
     """
-    chunks = []
-    for i, entity_type in enumerate(entities):
-        for j, entities_per_sentence in enumerate(entity_type):
-            if i==0:
-                chunks.append(entities_per_sentence)
-                continue
-      
-            chunks[j]["real"].extend(entities_per_sentence["real"])
-            chunks[j]["pred"].extend(entities_per_sentence["pred"])
-    return chunks
+    entities = [list(entity_type) for entity_type in entities]
+    for i, entity_type in enumerate(entities[1:], start=1):
+        if len(entity_type) != len(entities[0]):
+            raise ValueError('Entity type {} has {} sentences but entity type 0 has {}'.format(i, len(entity_type), len(entities[0])))
+    return [_merge_sentences(sentences, dedupe_real) for sentences in zip(*entities)]
+
+def _merge_sentences(sentences, dedupe_real):
+    if profiling.active is None:
+        return _merge_entities(sentences, dedupe_real)
+    with profiling.active.stage('merging', sentences=1) as span:
+        merged = _merge_entities(sentences, dedupe_real)
+        span.entities = len(merged["real"]) + len(merged["pred"])
+    return merged
+
+def _merge_entities(sentences, dedupe_real):
+    real = [entity for sent in sentences for entity in sent["real"]]
+    pred = [entity for sent in sentences for entity in sent["pred"]]
+    if dedupe_real:
+        real = list(dict.fromkeys(real))
+    return {"real": real, "pred": pred}
+
+def iter_merged_iob2_files(filepaths, dedupe_real=False, suffix=False):
+    """Read the IOB2 files predicted per entity type in lockstep and yield the merged entities of each sentence.
+    Every file must contain the same sentences, with the same number of tokens.
+    Args:
+        filepaths (list): filepaths of the IOB2 files, one per entity type.
+        dedupe_real (bool): keep only the first occurrence of original entities present in several files.
+        suffix (bool): tags have the prefix at the end (PER-B instead of B-PER), see get_entities.
+    Yields:
+        dict: predicted and original entities of one sentence, merged over all the files.
+    """
+    missing = object()
+    readers = [iter_iob2_sentences(filepath) for filepath in filepaths]
+    for i, tags in enumerate(zip_longest(*readers, fillvalue=missing)):
+        if any(sent is missing for sent in tags):
+            ended = [filepath for filepath, sent in zip(filepaths, tags) if sent is missing]
+            raise ValueError('Sentence count mismatch: {} ended before sentence {}'.format(ended, i))
+        lengths = [len(real_tags) for real_tags, _ in tags]
+        if any(length != lengths[0] for length in lengths):
+            raise ValueError('Token count mismatch in sentence {}: {}'.format(i, dict(zip(filepaths, lengths))))
+        sentences = [{"real": get_entities(real_tags, suffix), "pred": get_entities(pred_tags, suffix)} for real_tags, pred_tags in tags]
+        yield _merge_sentences(sentences, dedupe_real)
+
+def entity_tuples(entities):
+    """Entities of one side of a sentence as (chunk_type, chunk_start, chunk_end), unpacking the
+    span arrays of nestednereval.spans.
+    """
+    return entities.entities() if hasattr(entities, 'entities') else entities
 
-def get_nestings(entities):
+def get_nestings(entities, naive=False):
     """Gets nestings found per sentence.
     Args:
-        list (list of dicts): list with the list of real and pred entities per sentence.
+        entities (list): list of (chunk_type, chunk_start, chunk_end) of one sentence, or a SpanArray.
+        naive (bool): use the original all-pairs implementation instead of the sort-and-sweep one.
+            Both return identical nestings, the flag is kept to check them against each other.
     Returns:
-        list: list of nestings per sentences (each nesting is a list of entities).
+        list: list of nestings per sentences (each nesting is a list of entities, outermost entity first).
     Example:
-        >>> 
-        >>> seq = 
-        >>> 
-        
+        >>> entities = [('Body Part', 2, 2), ('Disease', 0, 2)]
+        >>> get_nestings(entities)
+        [[('Disease', 0, 2), ('Body Part', 2, 2)]]
     """
-    
+    find_nestings = _get_nestings_naive if naive else _get_nestings_sweep
+    entities = entity_tuples(entities)
+    if profiling.active is None:
+        return find_nestings(entities)
+    with profiling.active.stage('nestings', sentences=1, entities=len(entities)):
+        return find_nestings(entities)
+
+def _get_nestings_sweep(entities):
+    # Spans that are not strictly contained in another span. Sorted by (start, -end), a span is
+    # contained iff an earlier span reaches its end, so both coordinates grow strictly along the list.
+    outer_starts = []
+    outer_ends = []
+    for start, end in sorted({(e[1], e[2]) for e in entities}, key=lambda span: (span[0], -span[1])):
+        if not outer_ends or end > outer_ends[-1]:
+            outer_starts.append(start)
+            outer_ends.append(end)
+    outer_index = {span: i for i, span in enumerate(zip(outer_starts, outer_ends))}
+
+    # The outer spans containing an entity form the contiguous range [lo, hi).
+    members = [[] for _ in outer_starts]
+    for e in entities:
+        lo = bisect_left(outer_ends, e[2])
+        hi = bisect_right(outer_starts, e[1])
+        for i in range(lo, hi):
+            members[i].append(e)
+
+    nestings = []
+    seen = set()
+    for e1 in entities:
+        i = outer_index.get((e1[1], e1[2]))
+        if i is None:
+            continue
+        possible_nested_entity = [e1]
+        possible_nested_entity.extend(e2 for e2 in members[i] if e2 != e1)
+        if len(possible_nested_entity)==1:
+            continue
+        possible_nested_entity.sort(key=lambda x: (x[2]-x[1], x[0]), reverse=True)
+        key = tuple(possible_nested_entity)
+        if key not in seen:
+            seen.add(key)
+            nestings.append(possible_nested_entity)
+    return nestings
+
+def _get_nestings_naive(entities):
+    """All-pairs reference implementation of get_nestings."""
     nestings = [] 
     total = []
 
@@ -106,7 +226,133 @@ def get_nestings(entities):
     return nestings
 
 
+def _validate_chunk(chunk, suffix):
+    if chunk in ['O', 'B', 'I', 'E', 'S']:
+        return
+
+    if suffix:
+        if not chunk.endswith(('-B', '-I', '-E', '-S')):
+            warnings.warn('{} seems not to be NE tag.'.format(chunk))
+
+    else:
+        if not chunk.startswith(('B-', 'I-', 'E-', 'S-')):
+            warnings.warn('{} seems not to be NE tag.'.format(chunk))
+
+def _split_chunk(chunk, suffix):
+    if suffix:
+        return chunk[-1], chunk[:-1].rsplit('-', maxsplit=1)[0] or '_'
+    return chunk[0], chunk[1:].split('-', maxsplit=1)[-1] or '_'
+
+class TagDecoder:
+    """Decoder of tag sequences into entities through a precomputed transition table.
+    Each distinct tag string is validated, split into (prefix, type) and interned to an integer id
+    the first time it is seen. For every pair of interned tags the table stores whether a chunk
+    ends and/or starts between them, as computed by end_of_chunk and start_of_chunk, so decoding
+    is one table lookup per token and the output is the same as seqeval's get_entities.
+    Args:
+        suffix (bool): tags have the prefix at the end (PER-B instead of B-PER).
+    Example:
+        >>> decoder = TagDecoder()
+        >>> decoder.decode(['B-PER', 'I-PER', 'O', 'B-LOC'])
+        [('PER', 0, 1), ('LOC', 3, 3)]
+    """
+    END = 1
+    START = 2
+
+    def __init__(self, suffix=False):
+        self.suffix = suffix
+        self.tag_ids = {}
+        # Id 0 is the state before the first token (prefix 'O' and empty type).
+        self.prefixes = ['O']
+        self.types = ['']
+        self.transitions = [[0]]
+        self._lock = threading.Lock()
+        self.outside = self.intern('O')
+
+    def intern(self, chunk):
+        """Id of a tag string, adding it and its transitions to the table if it is new."""
+        tag_id = self.tag_ids.get(chunk)
+        if tag_id is not None:
+            return tag_id
+        with self._lock:
+            if chunk in self.tag_ids:
+                return self.tag_ids[chunk]
+            _validate_chunk(chunk, self.suffix)
+            tag, type_ = _split_chunk(chunk, self.suffix)
+            self.prefixes.append(tag)
+            self.types.append(type_)
+            tag_id = len(self.types) - 1
+            for prev_id, row in enumerate(self.transitions):
+                row.append(self._transition(prev_id, tag_id))
+            self.transitions.append([self._transition(tag_id, cur_id) for cur_id in range(tag_id + 1)])
+            self.tag_ids[chunk] = tag_id
+        return tag_id
+
+    def _transition(self, prev_id, cur_id):
+        prev_tag, prev_type = self.prefixes[prev_id], self.types[prev_id]
+        tag, type_ = self.prefixes[cur_id], self.types[cur_id]
+        code = 0
+        if end_of_chunk(prev_tag, tag, prev_type, type_):
+            code |= self.END
+        if start_of_chunk(prev_tag, tag, prev_type, type_):
+            code |= self.START
+        return code
+
+    def transition_table(self):
+        """Copy of the transition table (list of rows indexed by previous and current tag id)."""
+        with self._lock:
+            return [list(row) for row in self.transitions]
+
+    def decode(self, seq):
+        """Gets entities from sequence.
+        Args:
+            seq (list): sequence of labels (or list of sequences, decoded as one sequence).
+        Returns:
+            list: list of (chunk_type, chunk_start, chunk_end).
+        """
+        # for nested list
+        if any(isinstance(s, list) for s in seq):
+            seq = [item for sublist in seq for item in sublist + ['O']]
 
+        tag_ids = self.tag_ids
+        transitions = self.transitions
+        types = self.types
+        prev_id = 0
+        begin_offset = 0
+        chunks = []
+        for i, chunk in enumerate(seq):
+            tag_id = tag_ids.get(chunk)
+            if tag_id is None:
+                tag_id = self.intern(chunk)
+            code = transitions[prev_id][tag_id]
+            if code:
+                if code & 1:
+                    chunks.append((types[prev_id], begin_offset, i - 1))
+                if code & 2:
+                    begin_offset = i
+            prev_id = tag_id
+        if transitions[prev_id][self.outside] & 1:
+            chunks.append((types[prev_id], begin_offset, len(seq) - 1))
+        return chunks
+
+    def decode_batch(self, seqs):
+        """Gets entities from every sequence of a corpus.
+        Args:
+            seqs (iterable): sequences of labels.
+        Returns:
+            list: list of (chunk_type, chunk_start, chunk_end) lists, one per sequence.
+        """
+        decode = self.decode
+        return [decode(seq) for seq in seqs]
+
+_decoders = {}
+
+def get_decoder(suffix=False):
+    """Shared TagDecoder for the given tag format."""
+    decoder = _decoders.get(suffix)
+    if decoder is None:
+        decoder = _decoders.setdefault(suffix, TagDecoder(suffix))
+    return decoder
 
 def get_entities(seq, suffix=False):
     """Gets entities from sequence.
@@ -120,45 +366,30 @@ def get_entities(seq, suffix=False):
         >>> get_entities(seq)
         [('PER', 0, 1), ('LOC', 3, 3)]
     """
+    if profiling.active is None:
+        return get_decoder(suffix).decode(seq)
+    with profiling.active.stage('decoding', sentences=1) as span:
+        entities = get_decoder(suffix).decode(seq)
+        span.entities = len(entities)
+    return entities
 
-    def _validate_chunk(chunk, suffix):
-        if chunk in ['O', 'B', 'I', 'E', 'S']:
-            return
-
-        if suffix:
-            if not chunk.endswith(('-B', '-I', '-E', '-S')):
-                warnings.warn('{} seems not to be NE tag.'.format(chunk))
-
-        else:
-            if not chunk.startswith(('B-', 'I-', 'E-', 'S-')):
-                warnings.warn('{} seems not to be NE tag.'.format(chunk))
-
-    # for nested list
-    if any(isinstance(s, list) for s in seq):
-        seq = [item for sublist in seq for item in sublist + ['O']]
-
-    prev_tag = 'O'
-    prev_type = ''
-    begin_offset = 0
-    chunks = []
-    for i, chunk in enumerate(seq + ['O']):
-        _validate_chunk(chunk, suffix)
-
-        if suffix:
-            tag = chunk[-1]
-            type_ = chunk[:-1].rsplit('-', maxsplit=1)[0] or '_'
-        else:
-            tag = chunk[0]
-            type_ = chunk[1:].split('-', maxsplit=1)[-1] or '_'
-
-        if end_of_chunk(prev_tag, tag, prev_type, type_):
-            chunks.append((prev_type, begin_offset, i - 1))
-        if start_of_chunk(prev_tag, tag, prev_type, type_):
-            begin_offset = i
-        prev_tag = tag
-        prev_type = type_
-
-    return chunks
+def get_entities_batch(seqs, suffix=False):
+    """Gets entities from a corpus of sequences in one call.
+    Args:
+        seqs (iterable): sequences of labels.
+    Returns:
+        list: list of (chunk_type, chunk_start, chunk_end) lists, one per sequence.
+    Example:
+        >>> get_entities_batch([['B-PER', 'I-PER'], ['O', 'B-LOC']])
+        [[('PER', 0, 1)], [('LOC', 1, 1)]]
+    """
+    if profiling.active is None:
+        return get_decoder(suffix).decode_batch(seqs)
+    with profiling.active.stage('decoding') as span:
+        entities = get_decoder(suffix).decode_batch(seqs)
+        span.sentences = len(entities)
+        span.entities = sum(len(sequence_entities) for sequence_entities in entities)
+    return entities
 
 def end_of_chunk(prev_tag, tag, prev_type, type_):
     """Checks if a chunk ended between the previous and current word.
@@ -231,14 +462,14 @@ def start_of_chunk(prev_tag, tag, prev_type, type_):
     return chunk_start
 
 if __name__=='__main__':
-    anat_chunks = read_iob2_prediction_file('mlc-flair/clinical_trials_ANAT/test.tsv')
-    chem_chunks = read_iob2_prediction_file('mlc-flair/clinical_trials_CHEM/test.tsv')
-    entities = merge_predictions([anat_chunks, chem_chunks])
-    print(entities[0]["real"])
-    print(entities[0]["pred"])
-    real_nestings, pred_nestings = get_nestings(entities)
-    
-    for r, p in zip(real_nestings, pred_nestings):
-        if len(r)!=0:
-            print(r)
-            print(p)
+    # Print the merged entities and nestings of the IOB2 files predicted per entity type,
+    # e.g. python -m nestednereval.utils test_ANAT.tsv test_CHEM.tsv
+    import sys
+    for sent in iter_merged_iob2_files(sys.argv[1:]):
+        real_nestings = get_nestings(sent["real"])
+        pred_nestings = get_nestings(sent["pred"])
+        if real_nestings or pred_nestings:
+            print(sent["real"])
+            print(sent["pred"])
+            print(real_nestings)
+            print(pred_nestings)
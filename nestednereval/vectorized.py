@@ -0,0 +1,308 @@
+"""Vectorized evaluation of the entity metrics over columnar span arrays.
+Each side of a corpus (real or pred) is described by parallel arrays of sentence ids, type ids,
+start and end token indices, so the matching and the nesting structure are computed with NumPy
+array operations instead of per entity Python loops.
+"""
+import numpy as np
+
+from nestednereval.evaluator import EvaluationResult
+
+VECTORIZED_METRICS = ('standard', 'flat', 'inner', 'outer', 'nested', 'nesting')
+
+
+class SpanColumns:
+    """Entities of one side of a corpus as parallel arrays.
+    Args:
+        sentence_ids (array): sentence index of each entity.
+        type_ids (array): type index of each entity in the type vocabulary.
+        starts (array): start token index of each entity.
+        ends (array): end token index of each entity (inclusive).
+    """
+
+    def __init__(self, sentence_ids, type_ids, starts, ends):
+        self.sentence_ids = np.asarray(sentence_ids, dtype=np.int64)
+        self.type_ids = np.asarray(type_ids, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        if not (len(self.sentence_ids) == len(self.type_ids) == len(self.starts) == len(self.ends)):
+            raise ValueError('All the span columns must have the same length')
+
+    def __len__(self):
+        return len(self.sentence_ids)
+
+
+def build_type_vocabulary(entities):
+    """Sorted list of the entity types found in the real and predicted entities.
+    The type ids follow the order of the type names, which is the order get_nestings uses to
+    pick the outermost entity among entities sharing the same span.
+    """
+    types = set()
+    for sent in entities:
+        types.update(entity[0] for entity in sent["real"])
+        types.update(entity[0] for entity in sent["pred"])
+    return sorted(types)
+
+
+def _to_columns(entities, side, type_index):
+    sentence_ids = []
+    type_ids = []
+    starts = []
+    ends = []
+    for i, sent in enumerate(entities):
+        for entity in sent[side]:
+            sentence_ids.append(i)
+            type_ids.append(type_index[entity[0]])
+            starts.append(entity[1])
+            ends.append(entity[2])
+    return SpanColumns(sentence_ids, type_ids, starts, ends)
+
+
+def entities_to_columns(entities, types=None):
+    """Convert the list of dicts used by nestednereval.metrics into span columns.
+    Args:
+        entities (list(dict)): List of dicts containing predicted and original entities.
+        types (list): type vocabulary, built with build_type_vocabulary if not given.
+    Returns:
+        real (SpanColumns): original entities.
+        pred (SpanColumns): predicted entities.
+        types (list): type vocabulary, types[type_id] is the name of the type.
+    """
+    entities = list(entities)
+    if types is None:
+        types = build_type_vocabulary(entities)
+    type_index = {type_: i for i, type_ in enumerate(types)}
+    return _to_columns(entities, "real", type_index), _to_columns(entities, "pred", type_index), types
+
+
+def columns_to_entities(real, pred, types, n_sentences=None):
+    """Convert span columns back into the list of dicts used by nestednereval.metrics.
+    Args:
+        real (SpanColumns): original entities.
+        pred (SpanColumns): predicted entities.
+        types (list): type vocabulary.
+        n_sentences (int): number of sentences, inferred from the sentence ids if not given.
+    Returns:
+        list: list of dicts, which contains predicted and original entities.
+    """
+    if n_sentences is None:
+        n_sentences = int(max(real.sentence_ids.max(initial=-1), pred.sentence_ids.max(initial=-1))) + 1
+    entities = [{"real": [], "pred": []} for _ in range(n_sentences)]
+    for side, columns in (("real", real), ("pred", pred)):
+        for sentence_id, type_id, start, end in zip(columns.sentence_ids.tolist(), columns.type_ids.tolist(),
+                                                    columns.starts.tolist(), columns.ends.tolist()):
+            entities[sentence_id][side].append((types[type_id], start, end))
+    return entities
+
+
+def _sorted_unique(keys):
+    keys = np.sort(keys)
+    if len(keys):
+        keys = keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
+    return keys
+
+
+def _sorted_counts(keys):
+    # Sorted unique keys and the number of times each one appears in keys.
+    unique = _sorted_unique(keys)
+    return unique, np.bincount(np.searchsorted(unique, keys), minlength=len(unique))
+
+
+def _contains(sorted_keys, keys):
+    # Sorted-key join: membership of keys in the sorted unique array sorted_keys.
+    position = np.searchsorted(sorted_keys, keys)
+    found = position < len(sorted_keys)
+    found[found] = sorted_keys[position[found]] == keys[found]
+    return found
+
+
+def _containing_range(m_starts, m_ends, starts, ends):
+    # Outer spans of a sentence have strictly increasing starts and ends, so the ones
+    # containing a span are the contiguous range [lo, hi).
+    lo = np.searchsorted(m_ends, ends, side='left')
+    hi = np.searchsorted(m_starts, starts, side='right')
+    return lo, hi
+
+
+def _mix(values):
+    # splitmix64 finalizer, uint64 arithmetic wraps around.
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def _entity_hashes(keys):
+    # Two independent 64-bit hashes of every entity key.
+    keys = keys.astype(np.uint64)
+    return np.stack([_mix(keys), _mix(keys ^ np.uint64(0x9e3779b97f4a7c15))], axis=1)
+
+
+def _nesting_counts(keys, sentence_ids, type_ids, starts, ends, multiplicity, length, nestings=False):
+    """Per entity (outer, inner, nested, flat) counts of the lists built by EntityAnalysis.
+    Entities must be unique and sorted by (sentence, type, start, end), keys are their packed keys
+    and multiplicity gives the number of times each one appears in its sentence.
+    With nestings, a fifth array identifies every nesting by a row (outer span key, hash, hash):
+    the hashes are sums of the hashes of its members weighted by their multiplicity, so two
+    nestings of the same span with the same members have the same row whatever their order.
+    """
+    n = len(sentence_ids)
+    span_starts = sentence_ids*length + starts
+    span_ends = sentence_ids*length + ends
+
+    # Distinct spans sorted by (sentence, start, -end): a span is strictly contained in another
+    # one iff an earlier span of the same sentence reaches its end.
+    order_keys = _sorted_unique(span_starts*length + (length-1-ends))
+    u_starts = order_keys // length
+    u_ends = (u_starts - u_starts % length) + (length-1-order_keys % length)
+    reach = np.maximum.accumulate(u_ends) if len(u_ends) else u_ends
+    previous = np.concatenate(([-1], reach[:-1]))
+    maximal = previous < u_ends
+    m_starts = u_starts[maximal]
+    m_ends = u_ends[maximal]
+
+    # An outer span holds nestings iff it contains at least two distinct entities.
+    lo, hi = _containing_range(m_starts, m_ends, span_starts, span_ends)
+    size = np.bincount(lo, minlength=len(m_starts)+1) - np.bincount(hi, minlength=len(m_starts)+1)
+    bearing = np.cumsum(size)[:-1] >= 2
+    m_starts = m_starts[bearing]
+    m_ends = m_ends[bearing]
+    lo, hi = _containing_range(m_starts, m_ends, span_starts, span_ends)
+
+    # get_nestings builds one group per entity of the outer span: itself once and every other
+    # contained entity with its multiplicity, and keeps the distinct groups. The groups of the
+    # entities appearing once are all the same, each repeated entity gives a group of its own.
+    span_keys = span_starts*length + ends
+    m_keys = m_starts*length + (m_ends % length)
+    position = np.searchsorted(m_keys, span_keys)
+    on_outer = _contains(m_keys, span_keys)
+    single = on_outer & (multiplicity == 1)
+    repeated = on_outer & (multiplicity > 1)
+    n_groups = ((np.bincount(position[single], minlength=len(m_keys)) > 0).astype(np.int64)
+                + np.bincount(position[repeated], minlength=len(m_keys)))
+    cumulative = np.concatenate(([0], np.cumsum(n_groups)))
+    nested = multiplicity*(cumulative[hi] - cumulative[lo]) - np.where(repeated, multiplicity - 1, 0)
+
+    # The outermost entity of every group is the one with the outer span and the largest type.
+    by_span = np.lexsort((type_ids, span_keys))
+    last_of_span = np.ones(n, dtype=bool)
+    if n:
+        last_of_span[by_span[:-1]] = span_keys[by_span[:-1]] != span_keys[by_span[1:]]
+    outermost = last_of_span & on_outer
+    outer = np.zeros(n, dtype=np.int64)
+    outer[outermost] = n_groups[position[outermost]]
+    flat = np.where(hi == lo, multiplicity, 0)
+    if not nestings:
+        return outer, nested - outer, nested, flat
+
+    # Hash of the group shared by the single entities of every outer span: all its members.
+    counts = hi - lo
+    member = np.repeat(np.arange(n), counts)
+    span_index = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(lo, counts)
+    hashes = _entity_hashes(keys)
+    group_hashes = np.zeros((len(m_keys), 2), dtype=np.uint64)
+    np.add.at(group_hashes, span_index, hashes[member]*multiplicity[member, None].astype(np.uint64))
+    # The group of a repeated entity holds it only once.
+    shared = np.bincount(position[single], minlength=len(m_keys)) > 0
+    repeated = np.nonzero(repeated)[0]
+    own_hashes = group_hashes[position[repeated]] - hashes[repeated]*(multiplicity[repeated, None] - 1).astype(np.uint64)
+    rows = np.concatenate([np.column_stack([m_keys[shared].astype(np.uint64), group_hashes[shared]]),
+                           np.column_stack([m_keys[position[repeated]].astype(np.uint64), own_hashes])])
+    return outer, nested - outer, nested, flat, rows
+
+
+def _pack(columns, n_types, length):
+    return ((columns.sentence_ids*n_types + columns.type_ids)*length + columns.starts)*length + columns.ends
+
+
+def _unpack(keys, n_types, length):
+    ends = keys % length
+    keys = keys // length
+    starts = keys % length
+    keys = keys // length
+    return keys // n_types, keys % n_types, starts, ends
+
+
+def evaluate_columns(real, pred, metrics=None):
+    """Compute the entity metrics with array operations.
+    Duplicated entities of a sentence are counted as many times as nestednereval.evaluator counts
+    them, so the counts are identical to evaluate_all. Nestings are compared through a 128-bit hash
+    of their members within their outer span, so a mismatch needs a hash collision (probability
+    about 2**-128 per pair of nestings of the same span). Type ids must follow the order of the type
+    names (as built by entities_to_columns) for the outer and inner metrics to match
+    nestednereval.evaluator when several entities share the outermost span.
+    Args:
+        real (SpanColumns): original entities.
+        pred (SpanColumns): predicted entities.
+        metrics (iterable): metrics to compute, by default all of VECTORIZED_METRICS.
+    Returns:
+        EvaluationResult: counts and scores of every metric.
+    """
+    metrics = VECTORIZED_METRICS if metrics is None else tuple(metrics)
+    unknown = [metric for metric in metrics if metric not in VECTORIZED_METRICS]
+    if unknown:
+        raise ValueError('Unknown metrics: {}. Available metrics: {}'.format(unknown, VECTORIZED_METRICS))
+
+    n_types = int(max(real.type_ids.max(initial=-1), pred.type_ids.max(initial=-1))) + 1
+    n_sentences = int(max(real.sentence_ids.max(initial=-1), pred.sentence_ids.max(initial=-1))) + 1
+    length = int(max(real.ends.max(initial=-1), pred.ends.max(initial=-1),
+                     real.starts.max(initial=-1), pred.starts.max(initial=-1))) + 1
+    if float(n_sentences)*max(n_types, 1)*length*length >= 2**63:
+        raise ValueError('Span columns are too large to be packed into int64 keys')
+
+    real_keys = _pack(real, n_types, length)
+    pred_keys = _pack(pred, n_types, length)
+    result = EvaluationResult(metrics)
+
+    real_unique, real_multiplicity = _sorted_counts(real_keys)
+    pred_unique, pred_multiplicity = _sorted_counts(pred_keys)
+
+    if 'standard' in metrics:
+        tp = int(_contains(real_unique, pred_keys).sum())
+        fn = int((~_contains(pred_unique, real_keys)).sum())
+        result.counts['standard'] = [tp, len(pred_keys)-tp, fn, len(real_keys)]
+
+    families = [metric for metric in metrics if metric != 'standard']
+    if not families:
+        return result
+
+    nestings = 'nesting' in metrics
+    real_counts = _nesting_counts(real_unique, *_unpack(real_unique, n_types, length), real_multiplicity, length, nestings)
+    pred_counts = _nesting_counts(pred_unique, *_unpack(pred_unique, n_types, length), pred_multiplicity, length, nestings)
+    real_found = _contains(pred_unique, real_unique)
+    pred_missing = ~_contains(real_unique, pred_unique)
+
+    if nestings:
+        # The nestings of a side are distinct, so a row shared by both sides is a matched nesting.
+        real_rows, pred_rows = real_counts[4], pred_counts[4]
+        rows = np.concatenate([real_rows, pred_rows])
+        order = np.lexsort((rows[:, 2], rows[:, 1], rows[:, 0]))
+        sorted_rows = rows[order]
+        new = np.ones(len(rows), dtype=bool)
+        new[1:] = (sorted_rows[1:] != sorted_rows[:-1]).any(axis=1)
+        ids = np.empty(len(rows), dtype=np.int64)
+        ids[order] = np.cumsum(new) - 1
+        shared = np.bincount(ids, minlength=len(rows)) == 2
+        tp = int(shared[ids[:len(real_rows)]].sum())
+        fp = int((~shared[ids[len(real_rows):]]).sum())
+        result.counts['nesting'] = [tp, fp, len(real_rows)-tp, len(real_rows)]
+
+    for metric in (metric for metric in families if metric != 'nesting'):
+        # Columns of the counts returned by _nesting_counts.
+        column = ('outer', 'inner', 'nested', 'flat').index(metric)
+        real_weight, pred_weight = real_counts[column], pred_counts[column]
+        support = int(real_weight.sum())
+        tp = int(real_weight[real_found].sum())
+        fp = int(pred_weight[pred_missing].sum())
+        result.counts[metric] = [tp, fp, support-tp, support]
+    return result
+
+
+def vectorized_evaluate(entities, metrics=None):
+    """Convert the entities to span columns and evaluate them with evaluate_columns.
+    Args:
+        entities (list(dict)): List of dicts containing predicted and original entities.
+        metrics (iterable): metrics to compute, by default all of VECTORIZED_METRICS.
+    Returns:
+        EvaluationResult: counts and scores of every metric.
+    """
+    real, pred, _ = entities_to_columns(entities)
+    return evaluate_columns(real, pred, metrics)
@@ -24,4 +24,7 @@ setuptools.setup(
     python_requires=">=3.7",
     install_requires=install_requires,
     include_package_data=True,
+    entry_points={
+        'console_scripts': ['nestednereval=nestednereval.cli:main'],
+    },
 )
\ No newline at end of file